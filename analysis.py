@@ -1,16 +1,22 @@
 import pandas as pd
 import numpy as np
-from scipy.stats import skew, kurtosis
+import warnings
+
+STAT_COLUMNS = ['N', 'mean', 'std', 'skew', 'kurtosis', 'min',
+                '1%', '5%', '25%', '50%', '75%', '95%', '99%', 'max']
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
 
 
 class Analysis:
-    def __init__(self, betas_df):
-        """Initialize Analysis class with betas dataframe."""
-        self.betas = betas_df.copy()
+    def __init__(self, betas_df, copy=True):
+        """Initialize Analysis class with betas dataframe (shared rather than copied with copy=False)."""
+        self.betas = betas_df.copy() if copy else betas_df
         self.beta_cols = ['beta_12m', 'beta_24m', 'beta_36m']
 
     def descriptive_stats(self, x):
         """Calculate comprehensive descriptive statistics for a series."""
+        # scipy is only needed on this per-series path; the grouped statistics compute moments directly
+        from scipy.stats import skew, kurtosis
         x = x.dropna()
         if len(x) == 0:
             return pd.Series({
@@ -47,17 +53,47 @@ class Analysis:
             'max': x.max()
         })
 
+    def grouped_descriptive_stats(self, by='industry', cols=None):
+        """Descriptive statistics (as in descriptive_stats) for any grouping keys and columns at once.
+
+        Moments come from grouped sums of central powers; the seven percentiles of all
+        columns come from a single np.nanpercentile call per group.
+        """
+        cols = self.beta_cols if cols is None else list(cols)
+        keys = [by] if isinstance(by, str) else list(by)
+        values = self.betas[cols].astype(np.float64)
+        groups = [self.betas[key] for key in keys]
+        grouped = values.groupby(groups, observed=True)
+
+        n = grouped.count()
+        mean = grouped.mean()
+        dev = values - grouped.transform('mean')
+        m2 = (dev ** 2).groupby(groups, observed=True).sum() / n
+        m3 = (dev ** 3).groupby(groups, observed=True).sum() / n
+        m4 = (dev ** 4).groupby(groups, observed=True).sum() / n
+        # scipy.stats treats a variance below float resolution as zero and returns NaN
+        zero = m2 <= (np.finfo(np.float64).resolution * mean) ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            skewness = (m3 / m2 ** 1.5).where((n > 2) & ~zero)
+            kurt = (m4 / m2 ** 2 - 3).where((n > 3) & ~zero)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            # Groups iterate in the same sorted order as the aggregations above
+            pct = np.stack([np.nanpercentile(block.to_numpy(), PERCENTILES, axis=0) for _, block in grouped])
+
+        stats = {'N': n, 'mean': mean, 'std': grouped.std(), 'skew': skewness, 'kurtosis': kurt,
+                 'min': grouped.min()}
+        stats.update({f'{p}%': pd.DataFrame(pct[:, i, :], index=n.index, columns=cols)
+                      for i, p in enumerate(PERCENTILES)})
+        stats['max'] = grouped.max()
+
+        desc_stats = pd.concat({(col, stat): stats[stat][col] for col in cols for stat in STAT_COLUMNS}, axis=1)
+        return desc_stats.astype(np.float64)
+
     def get_descriptive_stats_by_industry(self, output_path=None):
         """Calculate descriptive statistics for beta by industry (not year)."""
-        desc_stats = self.betas.groupby('industry')[self.beta_cols].apply(
-            lambda df: df.apply(self.descriptive_stats)
-        ).unstack()
-
-        desc_stats = desc_stats.reindex(
-            columns=['N', 'mean', 'std', 'skew', 'kurtosis', 'min',
-                    '1%', '5%', '25%', '50%', '75%', '95%', '99%', 'max'],
-            level=1
-        )
+        desc_stats = self.grouped_descriptive_stats(by='industry', cols=self.beta_cols)
 
         if output_path:
             desc_stats.to_csv(output_path)
@@ -66,7 +102,7 @@ class Analysis:
 
     def get_annual_stats(self):
         """Calculate annual statistics (mean and std) by year and industry."""
-        annual_stats = self.betas.groupby(['year', 'industry'])[self.beta_cols].agg(['mean', 'std']).reset_index()
+        annual_stats = self.betas.groupby(['year', 'industry'], observed=True)[self.beta_cols].agg(['mean', 'std']).reset_index()
         annual_stats.columns = ['year', 'industry',
                                 'beta_12m_mean', 'beta_12m_std',
                                 'beta_24m_mean', 'beta_24m_std',
@@ -75,27 +111,30 @@ class Analysis:
 
     def analyze_missing_betas(self):
         """Analyze missing beta values by year and industry."""
-        missing_analysis = []
-
-        for year in self.betas['year'].unique():
-            for industry in self.betas['industry'].unique():
-                subset = self.betas[(self.betas['year'] == year) & (self.betas['industry'] == industry)]
-                total = len(subset)
-
-                if total > 0:
-                    for beta_col in self.beta_cols:
-                        missing_count = subset[beta_col].isna().sum()
-                        missing_pct = (missing_count / total) * 100
-                        missing_analysis.append({
-                            'year': year,
-                            'industry': industry,
-                            'beta_period': beta_col,
-                            'total_obs': total,
-                            'missing_count': missing_count,
-                            'missing_pct': missing_pct
-                        })
-
-        return pd.DataFrame(missing_analysis)
+        # Appearance-order codes keep the year-major, industry-minor row order of the output
+        year_codes, years = pd.factorize(self.betas['year'])
+        industry_codes, industries = pd.factorize(self.betas['industry'])
+        missing = self.betas[self.beta_cols].isna()
+        missing['_year'], missing['_industry'] = year_codes, industry_codes
+
+        counts = missing.groupby(['_year', '_industry']).agg(
+            total_obs=(self.beta_cols[0], 'size'),
+            **{col: (col, 'sum') for col in self.beta_cols}
+        ).reset_index()
+        counts = counts[(counts['_year'] >= 0) & (counts['_industry'] >= 0)]
+
+        missing_analysis = counts.melt(
+            id_vars=['_year', '_industry', 'total_obs'], value_vars=self.beta_cols,
+            var_name='beta_period', value_name='missing_count'
+        )
+        missing_analysis['_period'] = pd.Categorical(missing_analysis['beta_period'], self.beta_cols).codes
+        missing_analysis = missing_analysis.sort_values(['_year', '_industry', '_period'], kind='stable')
+        missing_analysis['missing_pct'] = (missing_analysis['missing_count'] / missing_analysis['total_obs']) * 100
+        missing_analysis.insert(0, 'year', years[missing_analysis['_year']])
+        missing_analysis.insert(1, 'industry', industries[missing_analysis['_industry']])
+
+        return missing_analysis[['year', 'industry', 'beta_period', 'total_obs',
+                                 'missing_count', 'missing_pct']].reset_index(drop=True)
 
     def get_volatility_trends(self):
         """Calculate annual average volatility components."""
@@ -106,44 +145,109 @@ class Analysis:
         vol_trends = self.betas.groupby("year")[vol_cols].mean().reset_index()
         return vol_trends
 
-    def form_quintile_portfolios(self, sort_col, ret_col="excess_stock",
-                                beta_col="beta_12m", mktcap_col="mktcap",
-                                time_col="year"):
-        """Form quintile portfolios sorted on a given column."""
-        df = self.betas.copy()
-        df[mktcap_col] = df[mktcap_col].abs()
-        ew_list, vw_list = [], []
-
-        for t, grp in df.groupby(time_col):
-            grp = grp.dropna(subset=[sort_col]).copy()
-            if grp.empty:
-                continue
+    @staticmethod
+    def qcut_codes(values, periods, n_bins=5):
+        """Vectorized pd.qcut(labels=False, duplicates="drop") + 1 within every period.
+
+        One lexsort orders all periods at once; the quantile edges of every period are
+        then interpolated exactly as np.percentile does for qcut, duplicate edges are
+        dropped, and each value is placed with the same left-searchsorted rule.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(len(values), np.nan)
+        idx = np.flatnonzero(~np.isnan(values))
+        if len(idx) == 0:
+            return out
+        order = idx[np.lexsort((values[idx], periods[idx]))]
+        v, t = values[order], periods[order]
+
+        starts = np.flatnonzero(np.r_[True, t[1:] != t[:-1]])
+        counts = np.diff(np.r_[starts, len(v)])
+        group = np.repeat(np.arange(len(starts)), counts)
+
+        # Linear-interpolated quantile edges, one row per period (mirrors np.percentile)
+        q = np.true_divide(np.linspace(0, 1, n_bins + 1) * 100.0, 100)
+        virtual = (counts[:, None] - 1) * q
+        above = virtual >= counts[:, None] - 1
+        prev = np.where(above, counts[:, None] - 1, np.floor(virtual)).astype(np.int64)
+        nxt = np.where(above, prev, prev + 1)
+        gamma = virtual - np.floor(virtual)
+        lo, hi = v[starts[:, None] + prev], v[starts[:, None] + nxt]
+        diff = hi - lo
+        edges = np.where(gamma >= 0.5, hi - diff * (1 - gamma), lo + diff * gamma)
+
+        first = np.ones(edges.shape, dtype=bool)
+        first[:, 1:] = edges[:, 1:] != edges[:, :-1]
+        n_unique = first.sum(axis=1)[group]
+        ids = np.zeros(len(v), dtype=np.int64)
+        for j in range(n_bins + 1):
+            ids += first[group, j] & (edges[group, j] < v)
+        ids[v == edges[group, 0]] = 1
+
+        labels = ids.astype(np.float64)
+        labels[(ids == 0) | (ids == n_unique)] = np.nan
+        out[order] = labels
+        return out
+
+    def assign_portfolios(self, sort_cols, n_bins=5, time_col="year"):
+        """Assign 1..n_bins portfolio numbers per period for several sort columns."""
+        periods = pd.factorize(self.betas[time_col])[0]
+        bins = {col: self.qcut_codes(self.betas[col].to_numpy(dtype=np.float64), periods, n_bins)
+                for col in sort_cols}
+        return pd.DataFrame(bins, index=self.betas.index)
+
+    def form_portfolios(self, sort_cols, n_bins=5, ret_col="excess_stock",
+                        beta_col="beta_12m", mktcap_col="mktcap", time_col="year"):
+        """Form EW and VW portfolios for many sort columns at once (time_col="date" rebalances monthly)."""
+        bins = self.assign_portfolios(sort_cols, n_bins=n_bins, time_col=time_col)
+        mktcap = self.betas[mktcap_col].abs()
+        base = pd.DataFrame({
+            time_col: self.betas[time_col],
+            "ew_ret": self.betas[ret_col],
+            "ew_beta": self.betas[beta_col],
+            "mc": mktcap,
+            "mc_ret": mktcap * self.betas[ret_col],
+            "mc_beta": mktcap * self.betas[beta_col],
+        })
 
-            grp["quintile"] = pd.qcut(grp[sort_col], 5, labels=False, duplicates="drop") + 1
+        # Stack the sorts so one grouped aggregation covers all of them
+        long = pd.concat(
+            [base.assign(sort_col=col, portfolio=bins[col]) for col in sort_cols],
+            ignore_index=True
+        ).dropna(subset=["portfolio"])
+        long["portfolio"] = long["portfolio"].astype(int)
 
-            for q, qgrp in grp.groupby("quintile"):
-                ew_ret = qgrp[ret_col].mean()
-                ew_beta = qgrp[beta_col].mean()
-                ew_list.append([t, q, ew_ret, ew_beta])
+        agg = long.groupby(["sort_col", time_col, "portfolio"], sort=False).agg(
+            ew_ret=("ew_ret", "mean"), ew_beta=("ew_beta", "mean"),
+            mc=("mc", "sum"), mc_ret=("mc_ret", "sum"), mc_beta=("mc_beta", "sum"))
+        # A portfolio without any market cap sums to 0, as the weighted np.sum always did
+        agg["vw_ret"] = (agg["mc_ret"] / agg["mc"]).where(agg["mc"] != 0, 0.0)
+        agg["vw_beta"] = (agg["mc_beta"] / agg["mc"]).where(agg["mc"] != 0, 0.0)
 
-                weights = qgrp[mktcap_col] / qgrp[mktcap_col].sum()
-                vw_ret = np.sum(weights * qgrp[ret_col])
-                vw_beta = np.sum(weights * qgrp[beta_col])
-                vw_list.append([t, q, vw_ret, vw_beta])
+        order = pd.Categorical(agg.index.get_level_values("sort_col"), categories=sort_cols)
+        agg = agg.reset_index().assign(_sort=order.codes).sort_values(["_sort", time_col, "portfolio"])
+        return agg[["sort_col", time_col, "portfolio", "ew_ret", "ew_beta", "vw_ret", "vw_beta"]].reset_index(drop=True)
 
-        ew_results = pd.DataFrame(ew_list, columns=[time_col, "quintile", "ew_ret", "ew_beta"])
-        vw_results = pd.DataFrame(vw_list, columns=[time_col, "quintile", "vw_ret", "vw_beta"])
+    def form_quintile_portfolios(self, sort_col, ret_col="excess_stock",
+                                beta_col="beta_12m", mktcap_col="mktcap",
+                                time_col="year"):
+        """Form quintile portfolios sorted on a given column."""
+        portfolios = self.form_portfolios([sort_col], n_bins=5, ret_col=ret_col, beta_col=beta_col,
+                                          mktcap_col=mktcap_col, time_col=time_col)
+        portfolios = portfolios.rename(columns={"portfolio": "quintile"})
+        ew_results = portfolios[[time_col, "quintile", "ew_ret", "ew_beta"]]
+        vw_results = portfolios[[time_col, "quintile", "vw_ret", "vw_beta"]]
 
         return ew_results, vw_results
 
-    def compute_spread(self, portfolios, ret_col):
-        """Compute average spread between Q5 and Q1 portfolios."""
+    def compute_spread(self, portfolios, ret_col, time_col="year", bin_col="quintile", top=5):
+        """Compute average spread between the top and bottom portfolios (Q5 - Q1 for quintiles)."""
         def spread_for_year(g):
-            q1 = g.loc[g["quintile"] == 1, ret_col]
-            q5 = g.loc[g["quintile"] == 5, ret_col]
+            q1 = g.loc[g[bin_col] == 1, ret_col]
+            q5 = g.loc[g[bin_col] == top, ret_col]
             if q1.empty or q5.empty:
                 return np.nan
             return q5.values[0] - q1.values[0]
 
-        spread = portfolios.groupby("year").apply(spread_for_year)
+        spread = portfolios.groupby(time_col).apply(spread_for_year)
         return spread.mean(skipna=True)
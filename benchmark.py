@@ -0,0 +1,249 @@
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+
+import numpy as np
+import pandas as pd
+
+from analysis import Analysis
+from data_processor import PreProcessor
+from feature_eng import FeatureEngineer
+from instrumentation import current_rss_mb, peak_rss_since_reset_mb, reset_peak_rss
+from panel_index import PanelIndex
+from visualizations import Visualizations
+
+SIC_CODES = ["0100", "1311", "1623", "2834", "3674", "4512", "5047", "5331", "6021", "7372", "9995", "0000"]
+DIRTY_RETURNS = ["C", "B", "", "-66.0", "A", "0.0123X"]
+# Loaded only by the code paths that need them; importing the pipeline modules must not pull them in
+HEAVY_MODULES = ["sklearn", "scipy", "matplotlib", "fredapi"]
+IMPORT_MODULES = ["main", "data_processor", "feature_eng", "analysis", "pipeline", "service"]
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "heavy_modules": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+class SyntheticRateSource():
+    def __init__(self, start="1990-01-01", end="2024-12-31", seed=0):
+        """Daily synthetic T-bill rate (percent, with holiday gaps) standing in for FRED DTB3."""
+        rng = np.random.default_rng(seed)
+        dates = pd.bdate_range(start, end)
+        rate = np.clip(3 + np.cumsum(rng.normal(0, 0.02, len(dates))), 0, None)
+        rate[rng.random(len(dates)) < 0.03] = np.nan
+        self.rf = pd.DataFrame({"date": dates, "rf": rate})
+
+    def get(self):
+        return self.rf.copy()
+
+
+def make_synthetic_crsp(n_permnos=1000, n_months=336, start="1996-01-31", seed=0):
+    """CRSP-shaped monthly panel with the PreProcessor.dtypes columns and dirty RET/RETX strings."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=n_months, freq="BME")
+    mkt = rng.normal(0.008, 0.045, n_months)
+
+    # Staggered listings and delistings, as in the real panel
+    first = rng.integers(0, n_months, n_permnos) * (rng.random(n_permnos) < 0.6)
+    last = np.minimum(first + rng.integers(12, n_months + 1, n_permnos), n_months)
+    lengths = last - first
+    firm = np.repeat(np.arange(n_permnos), lengths)
+    month = np.repeat(first, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+
+    beta = rng.normal(1.0, 0.5, n_permnos)
+    ret = beta[firm] * mkt[month] + rng.normal(0, 0.1, len(firm))
+    retx = ret - np.abs(rng.normal(0, 0.002, len(firm)))
+    prc = np.round(rng.lognormal(3, 1, n_permnos)[firm] * rng.lognormal(0, 0.05, len(firm)), 3)
+    prc[rng.random(len(firm)) < 0.1] *= -1
+
+    ret_str = np.char.mod("%.6f", ret).astype(object)
+    retx_str = np.char.mod("%.6f", retx).astype(object)
+    dirty = rng.random(len(firm)) < 0.02
+    ret_str[dirty] = rng.choice(DIRTY_RETURNS, dirty.sum())
+    retx_str[dirty] = ret_str[dirty]
+
+    permno = 10000 + np.arange(n_permnos)
+    return pd.DataFrame({
+        "PERMNO": permno[firm],
+        "date": dates[month].strftime("%Y-%m-%d"),
+        "SHRCD": rng.choice([10, 11], n_permnos)[firm],
+        "SICCD": rng.choice(SIC_CODES, n_permnos)[firm],
+        "TICKER": np.char.add("T", permno.astype(str))[firm],
+        "COMNAM": np.char.add("SYNTHETIC CO ", permno.astype(str))[firm],
+        "PERMCO": (50000 + np.arange(n_permnos))[firm],
+        "CUSIP": np.char.zfill(permno.astype(str), 8)[firm],
+        "BIDLO": np.abs(prc) * 0.95,
+        "ASKHI": np.abs(prc) * 1.05,
+        "PRC": prc,
+        "VOL": rng.integers(100, 10**6, len(firm)).astype(np.float64),
+        "RET": ret_str,
+        "BID": np.abs(prc) * 0.99,
+        "ASK": np.abs(prc) * 1.01,
+        "SHROUT": rng.integers(1000, 10**6, n_permnos)[firm].astype(np.float64),
+        "RETX": retx_str,
+        "vwretd": mkt[month],
+    })
+
+
+class StageTimer():
+    def __init__(self):
+        """Collects wall time, rows/sec and per-stage memory for named stages.
+
+        peak_rss_mb is the stage's own RSS high-water mark: the peak is reset before
+        each stage, so it is None where that is unsupported (non-Linux).
+        rss_delta_mb is the RSS the stage left behind.
+        """
+        self.stages = {}
+
+    def run(self, name, rows, func, *args, **kwargs):
+        reset = reset_peak_rss()
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        rss_after = current_rss_mb()
+        peak = peak_rss_since_reset_mb() if reset else None
+        n = rows(result) if callable(rows) else rows
+        self.stages[name] = {
+            "seconds": round(seconds, 4),
+            "rows": int(n),
+            "rows_per_sec": round(n / seconds, 1) if seconds > 0 else None,
+            "peak_rss_mb": None if peak is None else round(peak, 1),
+            "rss_delta_mb": None if rss_before is None or rss_after is None else round(rss_after - rss_before, 1),
+        }
+        return result
+
+
+def write_synthetic_csv(csv_path, n_permnos, n_months=336, seed=0):
+    """Generate a synthetic panel and write it to csv_path; returns the timings of both steps."""
+    timer = StageTimer()
+    raw = timer.run("generate", len, make_synthetic_crsp, n_permnos, n_months, seed=seed)
+    timer.run("write_csv", len(raw), raw.to_csv, csv_path, index=False)
+    return timer.stages
+
+
+def run_benchmark(csv_path, seed=0, n_jobs=1, plots=True, compact=False):
+    """Time every pipeline stage on a CSV written by write_synthetic_csv and return the report as a dict."""
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as tmp:
+        preprocessor = PreProcessor(cache_dir=os.path.join(tmp, "cache"), rate_source=SyntheticRateSource(seed=seed),
+                                    compact_layout=compact)
+        sample, crsp = timer.run("get_data", lambda out: len(out[1]), preprocessor.get_data,
+                                 csv_path, refresh_cache=True)
+        timer.run("get_data_cached", lambda out: len(out[1]), preprocessor.get_data, csv_path)
+
+        index = timer.run("panel_index", len(crsp), PanelIndex, crsp)
+        feature_eng = FeatureEngineer(sample, crsp, index=index, n_jobs=n_jobs, compact_layout=compact)
+        timer.run("excess_returns", len(crsp), feature_eng.excess_returns)
+        timer.run("rolling_moments", len(crsp), feature_eng.rolling_moments)
+        betas = timer.run("compute_sampled_betas", len, feature_eng.compute_sampled_betas)
+        betas = timer.run("calculate_volatilities", len, feature_eng.calculate_volatilities,
+                          betas, lookback_months=[12, 24, 36])
+        betas["mktcap"] = betas["PRC"].abs() * betas["SHROUT"]
+
+        analyzer = Analysis(betas, copy=not compact)
+        rows = len(betas)
+        timer.run("descriptive_stats_by_industry", rows, analyzer.get_descriptive_stats_by_industry)
+        annual_stats = timer.run("annual_stats", rows, analyzer.get_annual_stats)
+        missing = timer.run("missing_betas", rows, analyzer.analyze_missing_betas)
+        vol_trends = timer.run("volatility_trends", rows, analyzer.get_volatility_trends)
+        timer.run("portfolios", rows, analyzer.form_portfolios, ["beta_12m", "IVOL_12m"])
+
+        if plots:
+            visualizer = Visualizations(betas, annual_stats, interactive=False)
+            timer.run("plot_beta_mean", rows, visualizer.plot_all_beta_periods_mean,
+                      save_path=os.path.join(tmp, "beta_mean.png"))
+            timer.run("plot_beta_std", rows, visualizer.plot_all_beta_periods_std,
+                      save_path=os.path.join(tmp, "beta_std.png"))
+            timer.run("plot_volatility", rows, visualizer.plot_volatility_trends, vol_trends,
+                      save_path=os.path.join(tmp, "volatility.png"))
+            timer.run("plot_missing_heatmap", rows, visualizer.plot_missing_betas_heatmap, missing,
+                      save_path=os.path.join(tmp, "missing.png"))
+            timer.run("plots_batch", rows, visualizer.render_batch, [
+                ("plot_all_beta_periods_mean", {"save_path": os.path.join(tmp, "beta_mean.png")}),
+                ("plot_all_beta_periods_std", {"save_path": os.path.join(tmp, "beta_std.png")}),
+                ("plot_volatility_trends", {"vol_trends_df": vol_trends, "save_path": os.path.join(tmp, "volatility.png")}),
+                ("plot_missing_betas_heatmap", {"missing_df": missing, "save_path": os.path.join(tmp, "missing.png")}),
+            ])
+
+    return {"panel_rows": len(crsp), "sample_rows": len(sample), "n_jobs": n_jobs, "compact": compact, "stages": timer.stages}
+
+
+def import_times(modules=IMPORT_MODULES, repeats=5):
+    """Import time of each module in fresh interpreters (best of repeats) and the heavy modules it loads."""
+    results = []
+    for module in modules:
+        runs = []
+        for _ in range(repeats):
+            probe = subprocess.run([sys.executable, "-c", IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   capture_output=True, text=True, check=True)
+            runs.append(json.loads(probe.stdout.splitlines()[-1]))
+        results.append({"module": module, "seconds": min(run["seconds"] for run in runs),
+                        "heavy_modules": runs[0]["heavy_modules"]})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the beta pipeline on synthetic CRSP panels.")
+    parser.add_argument("--permnos", type=int, nargs="+", default=[1000],
+                        help="panel sizes to run, e.g. 1000 5000 30000")
+    parser.add_argument("--months", type=int, default=336)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--no-plots", action="store_true")
+    parser.add_argument("--compact", action="store_true", help="use the compact memory layout")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--imports", action="store_true",
+                        help="time importing the pipeline modules instead; exits 1 if one loads a heavy dependency")
+    parser.add_argument("--max-import-seconds", type=float,
+                        help="with --imports, also exit 1 if a module takes longer than this to import")
+    args = parser.parse_args()
+
+    if args.imports:
+        imports = import_times()
+        write_report({"python": sys.version.split()[0], "imports": imports}, args.output)
+        slow = args.max_import_seconds is not None and any(row["seconds"] > args.max_import_seconds
+                                                           for row in imports)
+        sys.exit(1 if slow or any(row["heavy_modules"] for row in imports) else 0)
+
+    reports = []
+    for n_permnos in args.permnos:
+        with tempfile.TemporaryDirectory() as tmp:
+            # The CSV is written here, so the measured process never holds the generated panel
+            csv_path = os.path.join(tmp, "MSF_synthetic.csv")
+            generated = write_synthetic_csv(csv_path, n_permnos, args.months, seed=args.seed)
+            # A fresh (spawned, not forked) process per size starts from a clean heap
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                report = pool.submit(run_benchmark, csv_path, args.seed, args.n_jobs,
+                                     not args.no_plots, args.compact).result()
+        report["stages"] = {**generated, **report["stages"]}
+        reports.append({"n_permnos": n_permnos, "n_months": args.months, **report})
+
+    write_report({"python": sys.version.split()[0], "pandas": pd.__version__,
+                  "numpy": np.__version__, "runs": reports}, args.output)
+
+
+def write_report(report, output=None):
+    """Write a JSON report to a file, or print it."""
+    report = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,57 @@
 import pandas as pd
 import numpy as np
+import hashlib
+import json
+import os
 import re
+import shutil
 import yaml
-from fredapi import Fred
+from panel_store import PanelStore
+from rates import rate_source_from_config
 
 SEED = 42
+CACHE_VERSION = 4
+
+# Identifier columns, dictionary-encoded on disk and in the compact layout
+IDENTIFIERS = ["SICCD", "TICKER", "COMNAM", "CUSIP"]
+# Columns the pipeline reads after cleaning; the compact layout projects the panel onto these
+PIPELINE_COLUMNS = ["PERMNO", "date", "PERMCO", "SHRCD", "SICCD", "TICKER", "PRC", "SHROUT",
+                    "RET", "RETX", "vwretd", "rf", "industry", "year", "month"]
+# Return columns held in single precision by the compact layout (the regressions accumulate in float64)
+COMPACT_RETURNS = {"RET": "float32", "RETX": "float32", "vwretd": "float32", "rf": "float32"}
+
+# Lower SIC bound of each industry range; codes in the gaps or beyond 9999 map to "Other"
+SIC_EDGES = np.array([1, 1000, 1500, 1800, 2000, 4000, 5000, 5200, 6000, 6800, 7000, 9000, 10000])
+SIC_LABELS = ["Agriculture, Forestry and Fishing",
+              "Mining",
+              "Construction",
+              "Other",
+              "Manufacturing",
+              "Transportation and other Utilities",
+              "Wholesale Trade",
+              "Retail Trade",
+              "Finance, Insurance and Real Estate",
+              "Other",
+              "Services",
+              "Public Administration"]
+INDUSTRIES = list(dict.fromkeys(SIC_LABELS))
 
 class PreProcessor():
-    def __init__(self, config_path: str = "config.yaml") -> None:
-        """Initialize the PreProcessor with FRED API access."""
+    def __init__(self, config_path: str = "config.yaml", cache_dir: str = "cache", rate_source=None,
+                 compact_layout: bool = False) -> None:
+        """Initialize the PreProcessor with a risk-free rate source (cached FRED by default).
+
+        With compact_layout=True frames are returned projected onto PIPELINE_COLUMNS,
+        with categorical identifiers and industry and float32 returns.
+        """
         
-        with open(config_path, 'r') as f:
-                config = yaml.safe_load(f)
-                fred_api_key = config['api_keys']['fred']
+        if rate_source is None:
+            with open(config_path, 'r') as f:
+                    config = yaml.safe_load(f)
+            rate_source = rate_source_from_config(config, cache_dir)
 
-        self.fred = Fred(api_key=fred_api_key)
+        self.rate_source = rate_source
+        self.compact_layout = compact_layout
         self.dtypes = {"PERMNO": "int64",
                     "SHRCD": "Int64",
                     "SICCD": "string",    
@@ -33,6 +70,23 @@ class PreProcessor():
                     "RETX": "string",      
                     "vwretd": "float64"
         }
+        # Compact on-disk dtypes for the cleaned frame; returns stay float64 for the regressions
+        self.cache_dir = cache_dir
+        self.cache_dtypes = {"PERMNO": "int32",
+                    "SHRCD": "Int16",
+                    "PERMCO": "Int32",
+                    "BIDLO": "float32",
+                    "ASKHI": "float32",
+                    "PRC": "float32",
+                    "VOL": "float32",
+                    "BID": "float32",
+                    "ASK": "float32",
+                    "SHROUT": "float32",
+                    **{col: "category" for col in IDENTIFIERS},
+                    "industry": "category",
+                    "year": "int16",
+                    "month": "int8"
+        }
 
     @staticmethod
     def clean_numeric(x):
@@ -74,35 +128,250 @@ class PreProcessor():
         else:
             return "Other"
     
-    def get_data(self, file_path = 'MSF_1996_2023.csv',sample_size: int = 10):
-        """Load and process CRSP data with risk-free rate and industry classification."""
-        # Read CRSP data into DataFrame
-        crsp = pd.read_csv(file_path, dtype=self.dtypes, parse_dates=["date"]).dropna() # type: ignore
-        
-        # Clean values in 'RET' and 'RETX' columns
-        crsp['RET'] = crsp['RET'].apply(self.clean_numeric)
-        crsp['RETX'] = crsp['RETX'].apply(self.clean_numeric)
+    @classmethod
+    def clean_numeric_series(cls, s):
+        """Vectorized clean_numeric over a whole column."""
+        cleaned = s.astype("string").str.replace(r'[^0-9eE\.\-+]', '', regex=True)
+        out = pd.Series(pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan),
+                        index=s.index)
+        # to_numeric rejects a few strings float() accepts (e.g. overflow to inf); defer those to the scalar path
+        retry = (out.isna() & cleaned.str.len().gt(0)).to_numpy(dtype=bool, na_value=False)
+        if retry.any():
+            out[retry] = cleaned[retry].map(cls.clean_numeric).to_numpy(dtype=np.float64)
+        return out
+
+    @staticmethod
+    def map_sic_series(s):
+        """Vectorized map_sic_to_industry over a whole column, returned as a categorical."""
+        s = s.astype("string")
+        is_code = s.str.fullmatch(r'\d+').to_numpy(dtype=bool, na_value=False)
+        sic = pd.to_numeric(s.where(is_code), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        bins = np.searchsorted(SIC_EDGES, sic, side='right') - 1
+        in_range = is_code & (bins >= 0) & (bins < len(SIC_LABELS))
+        labels = np.array(SIC_LABELS, dtype=object)[np.clip(bins, 0, len(SIC_LABELS) - 1)]
+        labels = np.where(in_range, labels, "Other")
+        # Sorted categories order like the plain labels in sorts and groupbys
+        return pd.Series(pd.Categorical(labels, categories=sorted(INDUSTRIES)), index=s.index)
+
+    def cache_key(self, file_path):
+        """Fingerprint the CSV (size, mtime, head/tail hash) together with the dtype schema."""
+        stat = os.stat(file_path)
+        digest = hashlib.sha256()
+        digest.update(json.dumps([CACHE_VERSION, stat.st_size, stat.st_mtime_ns,
+                                  self.dtypes, self.cache_dtypes], sort_keys=True).encode())
+        # Hashing the head and tail catches rewrites that preserve size and mtime without reading GBs
+        block = 1 << 20
+        with open(file_path, 'rb') as f:
+            digest.update(f.read(block))
+            if stat.st_size > block:
+                f.seek(max(stat.st_size - block, block))
+                digest.update(f.read(block))
+        return digest.hexdigest()[:16]
+
+    def cache_path(self, file_path):
+        """Location of the columnar cache for a given CSV."""
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}_{self.cache_key(file_path)}.parquet")
 
-        # Read risk-free data using FRED API and merge into CRSP data
-        rf = self.fred.get_series('DTB3')
+    def compact(self, crsp):
+        """Downcast the cleaned frame to the compact cache dtypes."""
+        return crsp.astype({col: dtype for col, dtype in self.cache_dtypes.items() if col in crsp.columns})
+
+    def risk_free_rate(self):
+        """Return the risk-free rate as a date-sorted (date, rf) frame without missing values."""
+        rf = self.rate_source.get()
+        return rf.dropna().sort_values('date').reset_index(drop=True)
+
+    @staticmethod
+    def risk_free_asof(dates, rf):
+        """The latest available risk-free rate on each of the sorted, distinct dates, indexed by date."""
+        asof = pd.merge_asof(pd.DataFrame({'date': dates}), rf, on='date', direction='backward')
+        return asof.set_index('date')['rf']
+
+    @classmethod
+    def attach_risk_free(cls, crsp, rf):
+        """As-of join the latest available risk-free rate onto every CRSP date, keeping row order."""
+        crsp['rf'] = crsp['date'].map(cls.risk_free_asof(np.unique(crsp['date'].to_numpy()), rf))
+        return crsp
+
+    def panel_dates(self, file_path):
+        """Distinct dates of the cleaned panel, read from the columnar cache (built on a miss)."""
+        return np.unique(self.load_data(file_path, columns=["date"])["date"].to_numpy())
+
+    def risk_free_key(self, file_path, rf=None):
+        """Fingerprint the risk-free rates load_data attaches to the panel's dates.
+
+        Observations the as-of join never picks (e.g. the days after the panel's last
+        month end) leave the key unchanged, so a daily refresh of the rate source does
+        not invalidate anything computed from an unchanged panel.
+        """
+        rf = self.risk_free_rate() if rf is None else rf
+        attached = self.risk_free_asof(self.panel_dates(file_path), rf)
+        return hashlib.sha256(pd.util.hash_pandas_object(attached).to_numpy().tobytes()).hexdigest()[:16]
+
+    def clean_frame(self, crsp):
+        """Clean returns, map industries and extract year/month on a raw CRSP frame."""
+        # Clean values in 'RET' and 'RETX' columns
+        crsp['RET'] = self.clean_numeric_series(crsp['RET'])
+        crsp['RETX'] = self.clean_numeric_series(crsp['RETX'])
         crsp['date'] = pd.to_datetime(crsp['date'])
-        rf = rf.reset_index()
-        rf.columns = ['date', 'rf']  
-        rf['date'] = pd.to_datetime(rf['date'])
-        crsp = crsp.merge(rf, on='date', how='left')
-        crsp['rf'] = crsp['rf'].ffill()
 
         # Map SIC Codes to industry
-        crsp['industry'] = crsp['SICCD'].apply(self.map_sic_to_industry)
+        crsp['industry'] = self.map_sic_series(crsp['SICCD'])
         
         # Extract year and month
         crsp['year'] = crsp['date'].dt.year # type: ignore
         crsp['month'] = crsp['date'].dt.month # type: ignore
+        return crsp
+
+    def clean_data(self, file_path, risk_free: bool = True):
+        """Load the CRSP CSV and return the cleaned frame with risk-free rate and industry.
+
+        With risk_free=False the rf column is left out, as in the columnar cache.
+        """
+        # Read CRSP data into DataFrame
+        crsp = pd.read_csv(file_path, dtype=self.dtypes, parse_dates=["date"]).dropna() # type: ignore
+        crsp = self.clean_frame(crsp)
+
+        # Attach the risk-free rate in effect on each date
+        if risk_free:
+            crsp = self.attach_risk_free(crsp, self.risk_free_rate())
+
+        return self.compact(crsp)
+
+    def stream_data(self, file_path, store_dir, sample_size: int = 10, chunksize: int = 1_000_000,
+                    overwrite: bool = False):
+        """Clean the CSV chunk by chunk into a year-partitioned Parquet store and sample it on the fly.
+
+        The risk-free rate is an as-of join, so chunks need no state from each other; like
+        the columnar cache, the store holds no rf column and read_store joins the current
+        rate on, so a refreshed rate source never requires rewriting the store.
+        The sample is a bottom-k reservoir: every row draws a uniform key and each
+        (year, industry) keeps its sample_size smallest keys, which is a uniform sample
+        without replacement that never needs the full panel in memory. It is seeded with SEED but does not reproduce the
+        rows drawn by get_data.
+        """
+        if os.path.exists(store_dir):
+            if not overwrite:
+                raise FileExistsError(f"{store_dir} already exists; pass overwrite=True to rebuild it")
+            shutil.rmtree(store_dir)
+
+        rng = np.random.default_rng(SEED)
+        reservoir = None
+
+        for chunk in pd.read_csv(file_path, dtype=self.dtypes, parse_dates=["date"], chunksize=chunksize): # type: ignore
+            # Dropped in place: clean_frame assigns columns, which on a dropna() result warns per column
+            chunk.dropna(inplace=True)
+            chunk = self.clean_frame(chunk)
+            chunk = self.compact(chunk)
+            chunk.to_parquet(store_dir, partition_cols=['year'], index=False)
+
+            chunk['_key'] = rng.random(len(chunk))
+            reservoir = chunk if reservoir is None else pd.concat([reservoir, chunk], ignore_index=True)
+            reservoir = (
+                reservoir
+                .sort_values('_key', kind='stable')
+                .groupby(['year', 'industry'], observed=True)
+                .head(sample_size)
+            )
+
+        if reservoir is None:
+            return pd.DataFrame()
+        sampled = reservoir.drop(columns='_key').sort_values(["year", "industry", "PERMNO"])
+        return self.in_memory(self.attach_risk_free(sampled, self.risk_free_rate()))
+
+    def in_memory(self, crsp):
+        """Convert frames read from disk to the in-memory layout, in place."""
+        if self.compact_layout:
+            return crsp.astype({col: dtype for col, dtype in COMPACT_RETURNS.items() if col in crsp.columns}, copy=False)
+
+        # Identifiers and industry are only categorical on disk; downstream code expects plain labels
+        for col in IDENTIFIERS:
+            if col in crsp.columns:
+                crsp[col] = crsp[col].astype("string")
+        if 'industry' in crsp.columns:
+            crsp['industry'] = crsp['industry'].astype(object)
+        return crsp
+
+    def export_panel(self, crsp, path, columns=None, overwrite: bool = False):
+        """Write a cleaned panel in the cache dtypes to a memory-mapped PanelStore and open it.
+
+        Workers open the store read-only (PanelStore(path)) instead of receiving a
+        pickled copy of the frame; its rows are in PanelIndex order, so
+        PanelIndex(crsp, store=...) reads the stored columns without sorting them.
+        """
+        columns = list(crsp.columns) if columns is None else list(dict.fromkeys(["PERMNO", "date", *columns]))
+        return PanelStore.write(self.compact(crsp[columns]), path, overwrite=overwrite)
+
+    def read_store(self, store_dir, years=None, columns=None):
+        """Read (a subset of years of) a partitioned store written by stream_data."""
+        filters = [('year', 'in', list(years))] if years is not None else None
+        if columns is None and self.compact_layout:
+            columns = PIPELINE_COLUMNS
+        crsp = self.read_with_risk_free(lambda cols: pd.read_parquet(store_dir, columns=cols, filters=filters),
+                                        columns)
+        if 'year' in crsp.columns:
+            crsp['year'] = crsp['year'].astype(self.cache_dtypes['year'])
+        return self.in_memory(crsp)
+
+    def load_data(self, file_path, refresh_cache: bool = False, columns=None):
+        """Return the cleaned CRSP frame, reading the columnar cache when it is current.
+
+        columns projects the frame (PIPELINE_COLUMNS by default in the compact layout);
+        on a cache hit only those columns are read from disk. The cache holds no rf
+        column: the risk-free rate is joined on after reading, so a refreshed or
+        reconfigured rate source takes effect without rebuilding the cache.
+        """
+        if columns is None and self.compact_layout:
+            columns = PIPELINE_COLUMNS
+        cache_path = self.cache_path(file_path)
+        if refresh_cache or not os.path.exists(cache_path):
+            crsp = self.clean_data(file_path, risk_free=False)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            crsp.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, cache_path)
+            del crsp
+
+        crsp = self.read_with_risk_free(lambda cols: pd.read_parquet(cache_path, columns=cols), columns)
+        return self.in_memory(crsp)
+
+    def read_with_risk_free(self, read, columns=None):
+        """Call read(columns) on rf-free cached data and join the current risk-free rate on.
+
+        The rate is attached when columns is None or names "rf" (in its position there);
+        "date" is read for the join even when it is not requested.
+        """
+        if columns is None:
+            return self.attach_risk_free(read(None), self.risk_free_rate())
+        if "rf" not in columns:
+            return read(list(columns))
+        stored = [col for col in columns if col != "rf"]
+        crsp = read(stored if "date" in stored else stored + ["date"])
+        crsp = self.attach_risk_free(crsp, self.risk_free_rate())
+        # Moved in place rather than reindexed, which would copy the whole panel
+        crsp.insert(list(columns).index("rf"), "rf", crsp.pop("rf"))
+        if "date" not in columns:
+            del crsp["date"]
+        return crsp
+
+    def get_data(self, file_path = 'MSF_1996_2023.csv',sample_size: int = 10, refresh_cache: bool = False,
+                 universe: str = "sample", columns=None):
+        """Load and process CRSP data with risk-free rate and industry classification.
+
+        With universe="all" no sampling is done and the full panel is returned in
+        place of the sample (the same frame, not a copy).
+        """
+        crsp = self.load_data(file_path, refresh_cache=refresh_cache, columns=columns)
+        if universe == "all":
+            return crsp, crsp
+        if universe != "sample":
+            raise ValueError(f"universe must be 'sample' or 'all', got {universe!r}")
 
         # Create random sample of 10 companies per industry for each year
         sampled = (
             crsp
-            .groupby(["year", "industry"], group_keys=False)
+            .groupby(["year", "industry"], group_keys=False, observed=True)
             .apply(lambda df: df.sample(n=min(sample_size, len(df)), random_state=SEED), include_groups=True)
             .sort_values(["year", "industry", "PERMNO"])
         )
@@ -1,12 +1,34 @@
-from sklearn.linear_model import LinearRegression
 import pandas as pd
 import numpy as np
+import os
+import time
+from incremental import IncrementalBetas
+from panel_index import PanelIndex
+from parallel import run_sharded
+from rolling import MOMENT_BYTES, RollingMoments, beta_columns, run_batched, volatility_columns
+from whatif import what_if_betas
+
+# Rough peak bytes of window temporaries per query in flight, used to size batches
+QUERY_BYTES = 512
 
 class FeatureEngineer():
-        def __init__(self, sample, crsp):
+        def __init__(self, sample, crsp, index=None, n_jobs=1, universe="sample", memory_budget_mb=1024,
+                     compact_layout=False, store=None):
                 self.sample = sample
                 self.crsp = crsp
-                self.model = LinearRegression()
+                self.index = index
+                self.store = store
+                self.n_jobs = n_jobs
+                self.universe = universe
+                self.compact_layout = compact_layout
+                # The budget is split evenly between the estimation processes; each builds the rolling
+                # moments of at most shard_rows panel rows and evaluates batch_size queries at a time
+                jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+                budget = int(memory_budget_mb * 2**20) // max(1, jobs)
+                self.batch_size = max(1, budget // QUERY_BYTES)
+                self.shard_rows = max(1, budget // MOMENT_BYTES)
+                self.throughput = {}
+                self._moments = None
                 
         def excess_returns(self):
                 """Engineers features related to excess market return and excess stock return"""
@@ -14,80 +36,96 @@ class FeatureEngineer():
                 self.sample["excess_mkt"] = self.sample["vwretd"] - self.sample["rf"]
                 self.crsp["excess_stock"] = self.crsp['RETX'] - self.crsp["rf"]
                 self.crsp["excess_mkt"] = self.crsp["vwretd"] - self.crsp["rf"]
+                if self.index is not None:
+                        self.index.invalidate("excess_stock", "excess_mkt")
+                self._moments = None
         
-        def compute_sampled_betas(self, lookback_periods=[12,24,36]):
-                """Engineers rolling beta for each lookback period"""
-                beta_results = []
-                model = LinearRegression()
-                for _, row in self.sample.iterrows():
-                        permno = row["PERMNO"]
-                        year = row["year"]
-                        end_date = pd.to_datetime(f"{year}-12-31")
-                        res = {"PERMNO": permno, "year": year}
-                        for lb in lookback_periods:
-                                start_date = end_date - pd.DateOffset(months=lb)
-                                window = self.crsp[
-                                        (self.crsp["PERMNO"] == permno) &
-                                        (self.crsp["date"] > start_date) &
-                                        (self.crsp["date"] <= end_date)
-                                ]
-                                mask = window[["excess_stock", "excess_mkt"]].notna().all(axis=1)
-                                window = window.loc[mask]
-                                if len(window) < 3:
-                                        res[f"beta_{lb}m"] = np.nan
-                                        continue
-                                y = window["excess_stock"].values
-                                X = window["excess_mkt"].values.reshape(-1, 1)
-                                model.fit(X, y)
-                                res[f"beta_{lb}m"] = model.coef_[0]
-                                res[f"alpha_{lb}m"] = model.intercept_
-                        beta_results.append(res)
-                beta_df = pd.DataFrame(beta_results)
-                merged = self.sample.merge(beta_df, on=["PERMNO", "year"], how="left")
-                return merged
+        def panel_index(self):
+                """Builds (once) the per-PERMNO date-sorted index over the CRSP panel"""
+                if self.index is None:
+                        self.index = PanelIndex(self.crsp, store=self.store)
+                return self.index
 
-        def calculate_volatilities(self, betas, lookback_months=12):
-                beta_col = f"beta_{lookback_months}m"
-                tvol_col, svol_col, ivol_col = (
-                        f"TVOL_{lookback_months}m",
-                        f"SVOL_{lookback_months}m",
-                        f"IVOL_{lookback_months}m"
-                )
-
-                out = []
+        def rolling_moments(self):
+                """Builds (once) the sorted per-PERMNO rolling moments of excess returns"""
+                if self._moments is None:
+                        self._moments = RollingMoments(self.panel_index())
+                return self._moments
 
-                crsp = self.crsp.copy()
-                crsp["date"] = pd.to_datetime(crsp["date"])
-                betas = betas.copy()
-                betas["date"] = pd.to_datetime(betas["date"])
+        def estimate(self, kernel, permnos, end_dates, betas=None, **params):
+                """Runs a rolling-window kernel serially, or sharded by PERMNO when n_jobs != 1 or the panel's
+                moments exceed the memory budget"""
+                queries = {"permnos": np.asarray(permnos), "end_dates": np.asarray(end_dates, dtype="datetime64[ns]")}
+                if betas is not None:
+                        queries["betas"] = betas
+                if len(queries["permnos"]) == 0 or (self.n_jobs == 1 and len(self.panel_index()) <= self.shard_rows):
+                        return run_batched(kernel, self.rolling_moments(), queries, params, self.batch_size)
+                return run_sharded(self.panel_index(), kernel, queries, params, n_jobs=self.n_jobs,
+                                   batch_size=self.batch_size, max_shard_rows=self.shard_rows)
 
-                for idx, row in betas.iterrows():
-                        permno, end_date, beta = row["PERMNO"], row["date"], row[beta_col]
+        def record_throughput(self, stage, rows, start):
+                """Stores rows, seconds and rows/sec of an estimation stage"""
+                seconds = time.perf_counter() - start
+                self.throughput[stage] = {"rows": rows, "seconds": seconds,
+                                          "rows_per_sec": rows / seconds if seconds > 0 else np.nan}
 
-                        if pd.isna(beta):
-                                out.append([np.nan, np.nan, np.nan])
-                                continue
+        def compute_sampled_betas(self, lookback_periods=[12,24,36]):
+                """Engineers rolling beta for each lookback period"""
+                start = time.perf_counter()
+                if self.universe == "all":
+                        merged = self.compute_universe_betas(lookback_periods)
+                else:
+                        beta_df = self.sample[["PERMNO", "year"]].reset_index(drop=True)
+                        end_dates = pd.to_datetime(pd.DataFrame({"year": beta_df["year"], "month": 12, "day": 31}))
+                        columns = self.estimate(beta_columns, beta_df["PERMNO"], end_dates, lookbacks=lookback_periods)
+                        for name, values in columns.items():
+                                beta_df[name] = values
+                        merged = self.sample.merge(beta_df, on=["PERMNO", "year"], how="left")
+                self.record_throughput("betas", len(merged), start)
+                return merged
 
-                        start_date = end_date - pd.DateOffset(months=lookback_months)
-                        window = crsp[(crsp["PERMNO"] == permno) &
-                                (crsp["date"] > start_date) &
-                                (crsp["date"] <= end_date)]
+        def compute_universe_betas(self, lookback_periods):
+                """Engineers year-end betas for every PERMNO-month, in place on the full panel"""
+                # One estimate per PERMNO-year, broadcast back to its months without a merge
+                permno = self.sample["PERMNO"].to_numpy(dtype=np.int64)
+                year = self.sample["year"].to_numpy(dtype=np.int64)
+                keys, inverse = np.unique(permno * 10000 + year, return_inverse=True)
+                end_dates = pd.to_datetime(pd.DataFrame({"year": keys % 10000, "month": 12, "day": 31}))
+                columns = self.estimate(beta_columns, keys // 10000, end_dates, lookbacks=lookback_periods)
+                for name, values in columns.items():
+                        self.sample[name] = values[inverse]
+                return self.sample
 
-                        if len(window) < 3:
-                                out.append([np.nan, np.nan, np.nan])
-                                continue
+        def calculate_volatilities(self, betas, lookback_months=12):
+                """Engineers TVOL/SVOL/IVOL for one lookback or a list of lookbacks in a single pass
 
-                        var_stock = np.var(window["excess_stock"], ddof=1)
-                        var_mkt = np.var(window["excess_mkt"], ddof=1)
-                        residuals = window["excess_stock"] - beta * window["excess_mkt"]
-                        var_resid = np.var(residuals, ddof=1)
+                The columns are added to a copy of betas, or to betas itself with universe="all"
+                or the compact layout.
+                """
+                if np.isscalar(lookback_months):
+                        lookback_months = [lookback_months]
 
-                        tvol = np.sqrt(var_stock)
-                        svol = beta * np.sqrt(var_mkt)
-                        ivol = np.sqrt(var_resid)
+                start = time.perf_counter()
+                if self.universe != "all" and not self.compact_layout:
+                        betas = betas.copy()
+                betas["date"] = pd.to_datetime(betas["date"])
+                beta_values = betas[[f"beta_{lb}m" for lb in lookback_months]].to_numpy(dtype=np.float64)
+                columns = self.estimate(volatility_columns, betas["PERMNO"], betas["date"],
+                                        lookbacks=lookback_months, betas=beta_values)
+                for name, values in columns.items():
+                        betas[name] = values
 
-                        out.append([tvol, svol, ivol])
+                self.record_throughput("volatilities", len(betas), start)
+                return betas
 
-                betas[[tvol_col, svol_col, ivol_col]] = pd.DataFrame(out, index=betas.index)
+        def what_if(self, lookback_periods=[12,24,36], estimators=["ols"], frequencies=["year"]):
+                """Engineers betas for many (lookback, estimator, end-date frequency) configurations as a long table"""
+                start = time.perf_counter()
+                table = what_if_betas(self.panel_index(), lookback_periods, estimators, frequencies,
+                                      batch_size=self.batch_size)
+                self.record_throughput("what_if", len(table), start)
+                return table
 
-                return betas
+        def incremental_state(self, lookback_periods=[12,24,36]):
+                """Seeds an append-only IncrementalBetas state from the current CRSP panel"""
+                return IncrementalBetas.from_index(self.panel_index(), lookback_periods)
@@ -0,0 +1,189 @@
+import pandas as pd
+import numpy as np
+from panel_index import to_days
+from rolling import ols_from_sums, volatilities_from_sums, window_starts
+
+EMPTY_DAY = np.iinfo(np.int64).min
+PAIR_MOMENTS = ["n", "x", "y", "xx", "xy", "yy"]
+
+
+def year_end_starts(years, lookback):
+    """Day number of the exclusive start of each year-end window."""
+    ends = pd.to_datetime(pd.DataFrame({"year": years, "month": 12, "day": 31}))
+    return to_days(window_starts(ends, lookback))
+
+
+def buffer_sums(days, x, y, lo_day, hi_day):
+    """Moment sums over buffered observations with lo_day < date <= hi_day (one row per PERMNO)."""
+    in_window = (days > lo_day[:, None]) & (days <= hi_day[:, None])
+    has_x = in_window & ~np.isnan(x)
+    has_y = in_window & ~np.isnan(y)
+    valid = has_x & has_y
+    x0 = np.where(has_x, x, 0.0)
+    y0 = np.where(has_y, y, 0.0)
+    xv = np.where(valid, x0, 0.0)
+    yv = np.where(valid, y0, 0.0)
+    return {"n": valid.sum(axis=1).astype(np.float64), "x": xv.sum(axis=1), "y": yv.sum(axis=1),
+            "xx": (xv * xv).sum(axis=1), "xy": (xv * yv).sum(axis=1), "yy": (yv * yv).sum(axis=1),
+            "rows": in_window.sum(axis=1).astype(np.float64),
+            "nx": has_x.sum(axis=1).astype(np.float64), "sx": x0.sum(axis=1), "sxx": (x0 * x0).sum(axis=1),
+            "ny": has_y.sum(axis=1).astype(np.float64), "sy": y0.sum(axis=1), "syy": (y0 * y0).sum(axis=1)}
+
+
+class IncrementalBetas():
+    def __init__(self, lookbacks=[12, 24, 36]):
+        """Append-only beta/volatility state: a ring buffer per PERMNO plus year-end window sums.
+
+        Each PERMNO keeps its last max(lookbacks) + 1 monthly observations and, per lookback,
+        the sums of the pairwise OLS moments over its current year-end window. A new
+        month adds to those sums, or re-anchors them from the buffer when it starts a
+        new year, so only the windows of PERMNOs that received data are touched.
+
+        Betas of an emitted month use the data available up to that month, i.e. they are
+        year-to-date estimates of the year-end window used by compute_sampled_betas and
+        coincide with it once December is in. Volatilities use the trailing window ending
+        at the month, as in calculate_volatilities.
+        """
+        self.lookbacks = list(lookbacks)
+        # A (date - lb months, date] window spans lb + 1 month-ends when the month's last
+        # trading day falls earlier than lb months before (e.g. 2000-12-29 vs 1997-12-31)
+        self.capacity = max(self.lookbacks) + 1
+        self._allocate(0)
+
+    def _allocate(self, n):
+        self.permnos = np.zeros(n, dtype=np.int64)
+        self.buf_days = np.full((n, self.capacity), EMPTY_DAY, dtype=np.int64)
+        self.buf_x = np.full((n, self.capacity), np.nan)
+        self.buf_y = np.full((n, self.capacity), np.nan)
+        self.head = np.zeros(n, dtype=np.int64)
+        self.last_day = np.full(n, EMPTY_DAY, dtype=np.int64)
+        self.anchor_year = np.zeros(n, dtype=np.int64)
+        self.sums = np.zeros((n, len(self.lookbacks), len(PAIR_MOMENTS)))
+
+    @classmethod
+    def from_index(cls, index, lookbacks=[12, 24, 36], x_col="excess_mkt", y_col="excess_stock"):
+        """Seed the state from the tail of every PERMNO in a PanelIndex."""
+        state = cls(lookbacks)
+        state._allocate(len(index.permnos))
+        state.permnos = index.permnos.copy()
+
+        # Rank of each row from the end of its PERMNO; only the last `capacity` rows are kept
+        from_end = index.offsets[index.codes + 1] - 1 - np.arange(len(index))
+        keep = from_end < state.capacity
+        counts = np.minimum(np.diff(index.offsets), state.capacity)
+        slot = counts[index.codes[keep]] - 1 - from_end[keep]
+        rows = index.codes[keep]
+        state.buf_days[rows, slot] = index.days[keep]
+        state.buf_x[rows, slot] = index.column(x_col)[keep]
+        state.buf_y[rows, slot] = index.column(y_col)[keep]
+        state.head = counts % state.capacity
+
+        state.last_day = index.days[index.offsets[1:] - 1]
+        state.anchor_year = state.last_day.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+        state._reanchor(np.arange(len(state.permnos)))
+        return state
+
+    def save(self, path):
+        """Persist the state as a single .npz file."""
+        np.savez_compressed(path, lookbacks=np.array(self.lookbacks), permnos=self.permnos,
+                            buf_days=self.buf_days, buf_x=self.buf_x, buf_y=self.buf_y, head=self.head,
+                            last_day=self.last_day, anchor_year=self.anchor_year, sums=self.sums)
+
+    @classmethod
+    def load(cls, path):
+        """Restore a state written by save."""
+        with np.load(path) as data:
+            state = cls(data["lookbacks"].tolist())
+            for name in ["permnos", "buf_days", "buf_x", "buf_y", "head", "last_day", "anchor_year", "sums"]:
+                setattr(state, name, data[name])
+        # States saved with a narrower buffer keep the width they were written with
+        state.capacity = state.buf_days.shape[1]
+        return state
+
+    def _add_permnos(self, permnos):
+        """Append empty state for PERMNOs seen for the first time and keep the table sorted."""
+        new = np.setdiff1d(permnos, self.permnos)
+        if len(new) == 0:
+            return
+        grown = IncrementalBetas(self.lookbacks)
+        grown.capacity = self.capacity
+        grown._allocate(len(new))
+        grown.permnos = new
+        order = np.argsort(np.concatenate([self.permnos, new]), kind="stable")
+        for name in ["permnos", "buf_days", "buf_x", "buf_y", "head", "last_day", "anchor_year", "sums"]:
+            setattr(self, name, np.concatenate([getattr(self, name), getattr(grown, name)])[order])
+
+    def _reanchor(self, rows):
+        """Recompute the year-end window sums of the given PERMNOs from their buffers."""
+        for i, lb in enumerate(self.lookbacks):
+            sums = buffer_sums(self.buf_days[rows], self.buf_x[rows], self.buf_y[rows],
+                               year_end_starts(self.anchor_year[rows], lb), self.last_day[rows])
+            self.sums[rows, i] = np.column_stack([sums[name] for name in PAIR_MOMENTS])
+
+    def update(self, new_rows):
+        """Fold newly arrived CRSP rows into the state and return them with beta/alpha/vol columns."""
+        new_rows = new_rows.copy()
+        if "excess_stock" not in new_rows:
+            new_rows["excess_stock"] = new_rows["RETX"] - new_rows["rf"]
+        if "excess_mkt" not in new_rows:
+            new_rows["excess_mkt"] = new_rows["vwretd"] - new_rows["rf"]
+
+        permno = new_rows["PERMNO"].to_numpy(dtype=np.int64)
+        days = to_days(new_rows["date"])
+        x = new_rows["excess_mkt"].to_numpy(dtype=np.float64)
+        y = new_rows["excess_stock"].to_numpy(dtype=np.float64)
+        self._add_permnos(np.unique(permno))
+
+        order = np.lexsort((days, permno))
+        rows = np.searchsorted(self.permnos, permno[order])
+        if np.any(np.diff(days[order])[np.diff(rows) == 0] <= 0) or np.any(days[order] <= self.last_day[rows]):
+            raise ValueError("update only accepts rows dated after the last stored month of each PERMNO")
+
+        # Step k processes the k-th new month of every PERMNO at once
+        first = np.r_[True, rows[1:] != rows[:-1]]
+        step = np.arange(len(order)) - np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+
+        out = {}
+        for lb in self.lookbacks:
+            out[f"beta_{lb}m"] = np.full(len(order), np.nan)
+            out[f"alpha_{lb}m"] = np.full(len(order), np.nan)
+        for lb in self.lookbacks:
+            for kind in ["TVOL", "SVOL", "IVOL"]:
+                out[f"{kind}_{lb}m"] = np.full(len(order), np.nan)
+
+        for k in range(step.max() + 1 if len(step) else 0):
+            pos = order[step == k]
+            self._step(rows[step == k], days[pos], x[pos], y[pos], pos, out)
+
+        for name, values in out.items():
+            new_rows[name] = values
+        return new_rows
+
+    def _step(self, rows, days, x, y, pos, out):
+        """Push one new month per PERMNO and emit its estimates into out at positions pos."""
+        self.buf_days[rows, self.head[rows]] = days
+        self.buf_x[rows, self.head[rows]] = x
+        self.buf_y[rows, self.head[rows]] = y
+        self.head[rows] = (self.head[rows] + 1) % self.capacity
+        self.last_day[rows] = days
+
+        years = days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+        moved = years != self.anchor_year[rows]
+        self.anchor_year[rows] = years
+        self._reanchor(rows[moved])
+
+        stay = ~moved
+        valid = ~(np.isnan(x) | np.isnan(y))
+        for i, lb in enumerate(self.lookbacks):
+            # Within the same year the window only grows: add the new pair if it falls inside it
+            add = stay & valid & (days > year_end_starts(years, lb))
+            xa, ya = x[add], y[add]
+            self.sums[rows[add], i] += np.column_stack([np.ones(len(xa)), xa, ya, xa * xa, xa * ya, ya * ya])
+
+            beta, alpha = ols_from_sums(dict(zip(PAIR_MOMENTS, self.sums[rows, i].T)))
+            out[f"beta_{lb}m"][pos], out[f"alpha_{lb}m"][pos] = beta, alpha
+
+            trailing = buffer_sums(self.buf_days[rows], self.buf_x[rows], self.buf_y[rows],
+                                   to_days(window_starts(days.astype("datetime64[D]"), lb)), days)
+            tvol, svol, ivol = volatilities_from_sums(trailing, beta)
+            out[f"TVOL_{lb}m"][pos], out[f"SVOL_{lb}m"][pos], out[f"IVOL_{lb}m"][pos] = tvol, svol, ivol
@@ -0,0 +1,181 @@
+import cProfile
+import functools
+import inspect
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+import pandas as pd
+from contextlib import contextmanager
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def current_rss_mb():
+    """Current resident set size in MB (Linux /proc), or None where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def reset_peak_rss():
+    """Reset this process's peak RSS to its current RSS (Linux /proc/self/clear_refs); False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_since_reset_mb():
+    """Peak resident set size since the last reset_peak_rss (VmHWM) in MB, or None where unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def count_rows(value):
+    """Row count of a frame/series/array, a list of counts for a tuple of them, else None."""
+    if isinstance(value, tuple):
+        counts = [count_rows(v) for v in value]
+        return counts if any(c is not None for c in counts) else None
+    if isinstance(value, (pd.DataFrame, pd.Series)) or getattr(value, "ndim", 0) > 0:
+        return len(value)
+    return None
+
+
+class Instrumentation():
+    def __init__(self, enabled=False, profile=False, trace_memory=False, output_dir="outputs/profiles"):
+        """Records wall/CPU time, rows in/out and memory (RSS before/after, peak) per pipeline stage.
+
+        When disabled, instrument() returns objects untouched and stage() only yields,
+        so the pipeline runs exactly as without it. profile writes a cProfile dump and
+        trace_memory a tracemalloc peak for every top-level stage (nested stages are
+        timed only, since neither tool can be stacked).
+        """
+        self.enabled = enabled
+        self.profile = enabled and profile
+        self.trace_memory = enabled and trace_memory
+        self.output_dir = output_dir
+        self.records = []
+        self._depth = 0
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Time a block of code as a named stage; the yielded dict takes rows_out."""
+        record = {"stage": name}
+        if not self.enabled:
+            yield record
+            return
+
+        top = self._depth == 0
+        profiler = cProfile.Profile() if top and self.profile else None
+        if top and self.trace_memory:
+            tracemalloc.start()
+        rss_before = peak_rss_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        record.update({"depth": self._depth, "rows_in": rows_in, "rss_before_mb": current_rss_mb()})
+        self.records.append(record)
+        number = len(self.records)
+        self._depth += 1
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self._depth -= 1
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["rss_after_mb"] = current_rss_mb()
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["peak_rss_delta_mb"] = record["peak_rss_mb"] - rss_before
+            if top and self.trace_memory:
+                record["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+            if profiler is not None:
+                os.makedirs(self.output_dir, exist_ok=True)
+                record["profile"] = os.path.join(self.output_dir, f"{number:02d}_{name}.prof")
+                profiler.dump_stats(record["profile"])
+
+    def wrap(self, name, method, frame_attr=None, bound=False):
+        """Wrap a callable so every call is recorded as a stage.
+
+        rows_in is the length of the first frame-like argument, else (for methods,
+        bound=True) the length of the instance's frame_attr frame.
+        """
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            values = args[1:] if bound else args
+            rows_in = next((count_rows(a) for a in values if count_rows(a) is not None), None)
+            if rows_in is None and bound and frame_attr:
+                rows_in = count_rows(getattr(args[0], frame_attr, None))
+            with self.stage(name, rows_in=rows_in) as record:
+                result = method(*args, **kwargs)
+                record["rows_out"] = count_rows(result)
+            return result
+        return wrapper
+
+    def instrument(self, obj, methods=None, frame_attr=None):
+        """Wrap the public methods of an instance and return it.
+
+        The instance is moved to a subclass whose methods are wrapped, so no wrapper
+        holds a reference to it and its frames are freed as soon as it goes away.
+        frame_attr names the instance's working frame (e.g. "betas"), whose length is
+        reported as rows_in for methods called without a frame argument.
+        """
+        if not self.enabled:
+            return obj
+        cls = type(obj)
+        names = methods or [n for n in dir(cls) if not n.startswith("_")]
+        namespace = {}
+        for name in names:
+            attr = inspect.getattr_static(cls, name, None)
+            if isinstance(attr, staticmethod):
+                namespace[name] = staticmethod(self.wrap(f"{cls.__name__}.{name}", attr.__func__))
+            elif inspect.isfunction(attr):
+                namespace[name] = self.wrap(f"{cls.__name__}.{name}", attr, frame_attr=frame_attr, bound=True)
+        obj.__class__ = type(cls.__name__, (cls,), namespace)
+        return obj
+
+    def report(self):
+        """Structured run report: one entry per stage call, in call order."""
+        return {"enabled": self.enabled,
+                "total_wall_seconds": time.perf_counter() - self._started,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": self.records}
+
+    def summary(self):
+        """Per-stage totals as a DataFrame, slowest first."""
+        if not self.records:
+            return pd.DataFrame()
+        records = pd.DataFrame(self.records)
+        return (records.groupby("stage")
+                .agg(calls=("wall_seconds", "size"), wall_seconds=("wall_seconds", "sum"),
+                     cpu_seconds=("cpu_seconds", "sum"), rss_after_mb=("rss_after_mb", "last"),
+                     peak_rss_delta_mb=("peak_rss_delta_mb", "max"))
+                .sort_values("wall_seconds", ascending=False))
+
+    def write_report(self, path):
+        """Write the run report as JSON."""
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, default=str)
@@ -1,63 +1,255 @@
-from data_processor import PreProcessor
+import argparse
+import os
+import pandas as pd
+from data_processor import PreProcessor, SEED
 from feature_eng import FeatureEngineer
+from panel_index import PanelIndex
+from panel_store import PanelStore
 from analysis import Analysis
-from visualizations import Visualizations
+from instrumentation import Instrumentation
+from pipeline import ArtifactCache, Pipeline, Stage
 
+LOOKBACKS = [12, 24, 36]
+ANALYSIS_COLUMNS = ["PERMNO", "date", "year", "month", "industry", "PRC", "SHROUT", "excess_stock"]
+STORE_COLUMNS = ["PERMNO", "date", "excess_mkt", "excess_stock"]
+# Modules each kind of stage delegates to; their source is part of the stage keys
+CODE = {"load": ["data_processor", "rates"],
+        "estimation": ["feature_eng", "panel_index", "rolling", "parallel", "panel_store"],
+        "analysis": ["analysis"],
+        "plots": ["visualizations"]}
+PLOTS = {"mean": 'outputs/beta_mean_trends',
+         "std": 'outputs/beta_std_trends',
+         "volatility": 'outputs/volatility_trends',
+         "missing": 'outputs/missing_betas_12m'}
 
-def main():
-    preprocessor = PreProcessor()
-    sample, crsp = preprocessor.get_data()
-    
-    feature_eng = FeatureEngineer(sample, crsp)
+
+def load(file_path, sample_size, seed, universe, compact, fingerprint, preprocessor, instr):
+    preprocessor = instr.instrument(preprocessor)
+    return preprocessor.get_data(file_path, sample_size=sample_size, universe=universe)
+
+
+def excess_returns(data, compact, instr):
+    sample, crsp = data
+    feature_eng = instr.instrument(FeatureEngineer(sample, crsp, compact_layout=compact), frame_attr="crsp")
     feature_eng.excess_returns()
-    betas = feature_eng.compute_sampled_betas()
-    betas = feature_eng.calculate_volatilities(betas, lookback_months=12)
-    betas = feature_eng.calculate_volatilities(betas, lookback_months=24)
-    betas = feature_eng.calculate_volatilities(betas, lookback_months=36)
+    return feature_eng.sample, feature_eng.crsp
+
+
+def panel_store(crsp, path, preprocessor):
+    """Open the memory-mapped store of the excess-return panel, exporting it on first use."""
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return PanelStore(path)
+    return preprocessor.export_panel(crsp, path, columns=STORE_COLUMNS)
+
+
+def engineer(data, engines, universe, compact, n_jobs, memory_budget_mb, instr, store_path, preprocessor):
+    """FeatureEngineer over the excess-return panel, shared by the beta and volatility stages."""
+    sample, crsp = data
+    if id(crsp) not in engines:
+        store = panel_store(crsp, store_path, preprocessor) if store_path else None
+        engines[id(crsp)] = instr.instrument(FeatureEngineer(sample, crsp, index=PanelIndex(crsp, store=store),
+                                                             n_jobs=n_jobs,
+                                                             universe=universe, memory_budget_mb=memory_budget_mb,
+                                                             compact_layout=compact),
+                                             frame_attr="crsp")
+    return engines[id(crsp)]
+
+
+def betas(data, lookbacks, universe, compact, engines, n_jobs, memory_budget_mb, instr, store_path, preprocessor):
+    feature_eng = engineer(data, engines, universe, compact, n_jobs, memory_budget_mb, instr, store_path, preprocessor)
+    betas = feature_eng.compute_sampled_betas(lookbacks)
+    print_throughput(feature_eng, "betas")
+    return betas
 
+
+def volatilities(data, betas, lookback, universe, compact, engines, n_jobs, memory_budget_mb, instr, store_path,
+                 preprocessor):
+    feature_eng = engineer(data, engines, universe, compact, n_jobs, memory_budget_mb, instr, store_path, preprocessor)
+    vols = feature_eng.calculate_volatilities(betas, lookback_months=lookback)
+    print_throughput(feature_eng, "volatilities")
+    return vols[[f"{kind}_{lookback}m" for kind in ["TVOL", "SVOL", "IVOL"]]]
+
+
+def mktcap(betas, *vols, compact, engines):
+    # Estimation is over: drop the shared panel index and rolling moments
+    engines.clear()
+    vol_cols = [col for vol in vols for col in vol.columns]
+    if compact:
+        # The volatility stages added their columns to betas in place (unless they were cached);
+        # only what the analysis and plots read is carried past this point
+        keep = ANALYSIS_COLUMNS + vol_cols + [col for col in betas.columns if col.startswith(("beta_", "alpha_"))]
+        betas.drop(columns=[col for col in betas.columns if col not in keep], inplace=True)
+        for vol in vols:
+            for col in vol.columns:
+                if col not in betas.columns:
+                    betas[col] = vol[col]
+    else:
+        # With universe="all" the volatility stages add their columns to betas in place
+        betas = pd.concat([betas.drop(columns=vol_cols, errors="ignore"), *vols], axis=1)
+    betas["date"] = pd.to_datetime(betas["date"])
     betas["mktcap"] = betas["PRC"].abs() * betas["SHROUT"]
+    return betas
 
-    analyzer = Analysis(betas)
-    desc_stats = analyzer.get_descriptive_stats_by_industry(output_path='outputs/descriptive_stats_by_industry.csv')
-    print(desc_stats)
 
-    annual_stats = analyzer.get_annual_stats()
+def desc_stats(betas, compact, instr):
+    analyzer = instr.instrument(Analysis(betas, copy=not compact), frame_attr="betas")
+    return analyzer.get_descriptive_stats_by_industry(output_path='outputs/descriptive_stats_by_industry.csv')
 
-    missing_betas = analyzer.analyze_missing_betas()
-    missing_summary = missing_betas.groupby('beta_period')['missing_pct'].describe()
-    print(missing_summary)
 
-    vol_trends = analyzer.get_volatility_trends()
+def annual_stats(betas, compact, instr):
+    return instr.instrument(Analysis(betas, copy=not compact), frame_attr="betas").get_annual_stats()
 
-    visualizer = Visualizations(betas, annual_stats)
-    visualizer.plot_all_beta_periods_mean(save_path='outputs/beta_mean_trends.png')
-    visualizer.plot_all_beta_periods_std(save_path='outputs/beta_std_trends.png')
-    visualizer.plot_volatility_trends(vol_trends, save_path='outputs/volatility_trends.png')
-    visualizer.plot_missing_betas_heatmap(missing_betas, beta_period='beta_12m', save_path='outputs/missing_betas_12m.png')
 
-    ew_beta, vw_beta = analyzer.form_quintile_portfolios(
-        sort_col="beta_12m",
-        ret_col="excess_stock",
-        beta_col="beta_12m",
-        mktcap_col="mktcap"
-    )
+def missing(betas, compact, instr):
+    return instr.instrument(Analysis(betas, copy=not compact), frame_attr="betas").analyze_missing_betas()
 
-    spread_ew_beta = analyzer.compute_spread(ew_beta, "ew_ret")
-    spread_vw_beta = analyzer.compute_spread(vw_beta, "vw_ret")
-    
-    ew_ivol, vw_ivol = analyzer.form_quintile_portfolios(
-        sort_col="IVOL_12m",
+
+def vol_trends(betas, compact, instr):
+    return instr.instrument(Analysis(betas, copy=not compact), frame_attr="betas").get_volatility_trends()
+
+
+def portfolios(betas, sort_cols, n_bins, compact, instr):
+    analyzer = instr.instrument(Analysis(betas, copy=not compact), frame_attr="betas")
+    portfolios = analyzer.form_portfolios(
+        sort_cols=sort_cols,
+        n_bins=n_bins,
         ret_col="excess_stock",
         beta_col="beta_12m",
         mktcap_col="mktcap"
     )
+    spreads = {}
+    for col in sort_cols:
+        ports = portfolios[portfolios["sort_col"] == col]
+        for weight in ["ew", "vw"]:
+            spreads[(col, weight)] = analyzer.compute_spread(ports, f"{weight}_ret", bin_col="portfolio", top=n_bins)
+    return portfolios, spreads
+
+
+def plots(betas, annual_stats, vol_trends, missing, paths, dpi, fmt, n_jobs, instr):
+    # matplotlib is only loaded by runs that draw figures
+    from visualizations import Visualizations
+    visualizer = instr.instrument(Visualizations(betas, annual_stats, dpi=dpi, fmt=fmt, interactive=False),
+                                  frame_attr="betas")
+    return visualizer.render_batch([
+        ("plot_all_beta_periods_mean", {"save_path": paths["mean"]}),
+        ("plot_all_beta_periods_std", {"save_path": paths["std"]}),
+        ("plot_volatility_trends", {"vol_trends_df": vol_trends, "save_path": paths["volatility"]}),
+        ("plot_missing_betas_heatmap", {"missing_df": missing, "beta_period": 'beta_12m', "save_path": paths["missing"]}),
+    ], n_jobs=n_jobs)
+
+
+def print_throughput(feature_eng, name):
+    """Print the throughput of the estimation just recorded under name (the engine is shared across stages)."""
+    stats = feature_eng.throughput[name]
+    print(f"{name}: {stats['rows']} rows in {stats['seconds']:.2f}s ({stats['rows_per_sec']:,.0f} rows/sec)")
+
+
+def build_pipeline(file_path='MSF_1996_2023.csv', sample_size=10, universe="sample", lookbacks=LOOKBACKS,
+                   sort_cols=["beta_12m", "IVOL_12m"], n_bins=5, n_jobs=1, memory_budget_mb=1024,
+                   dpi=300, fig_format="png", plot_jobs=None, compact=False, cache=None, instrumentation=None,
+                   store_dir=None):
+    """Express the beta/volatility study as a DAG of cached stages.
+
+    compact=True runs on the compact memory layout: projected columns, categorical
+    identifiers, float32 returns and derived columns added in place. With store_dir,
+    the excess-return panel is exported once to a memory-mapped PanelStore there,
+    which estimation workers open read-only.
+    """
+    instr = instrumentation or Instrumentation(enabled=False)
+    preprocessor = PreProcessor(compact_layout=compact)
+    # The CSV fingerprint (size, mtime, head/tail hash) and the risk-free rates attached to the panel's
+    # dates root every downstream key
+    fingerprint = [preprocessor.cache_key(file_path), preprocessor.risk_free_key(file_path)]
+    engines = {}
+    workers = {"engines": engines, "n_jobs": n_jobs, "memory_budget_mb": memory_budget_mb, "instr": instr,
+               "store_path": None, "preprocessor": preprocessor}
+    layout = {"compact": compact}
+    vol_stages = [f"vols_{lb}m" for lb in lookbacks]
+    paths = {name: f"{stem}.{fig_format}" for name, stem in PLOTS.items()}
+
+    stages = [
+        Stage("load", load, params={"file_path": file_path, "sample_size": sample_size, "seed": SEED,
+                                    "universe": universe, "fingerprint": fingerprint, **layout},
+              context={"preprocessor": preprocessor, "instr": instr}, code=CODE["load"]),
+        Stage("excess_returns", excess_returns, deps=["load"], params=layout, context={"instr": instr},
+              code=CODE["estimation"]),
+        Stage("betas", betas, deps=["excess_returns"],
+              params={"lookbacks": list(lookbacks), "universe": universe, **layout}, context=workers,
+              code=CODE["estimation"]),
+        *[Stage(name, volatilities, deps=["excess_returns", "betas"],
+                params={"lookback": lb, "universe": universe, **layout}, context=workers, code=CODE["estimation"])
+          for name, lb in zip(vol_stages, lookbacks)],
+        Stage("mktcap", mktcap, deps=["betas", *vol_stages], params=layout, context={"engines": engines}),
+        Stage("desc_stats", desc_stats, deps=["mktcap"], params=layout, context={"instr": instr},
+              outputs=['outputs/descriptive_stats_by_industry.csv'], code=CODE["analysis"]),
+        Stage("annual_stats", annual_stats, deps=["mktcap"], params=layout, context={"instr": instr},
+              code=CODE["analysis"]),
+        Stage("missing", missing, deps=["mktcap"], params=layout, context={"instr": instr}, code=CODE["analysis"]),
+        Stage("vol_trends", vol_trends, deps=["mktcap"], params=layout, context={"instr": instr},
+              code=CODE["analysis"]),
+        Stage("portfolios", portfolios, deps=["mktcap"],
+              params={"sort_cols": list(sort_cols), "n_bins": n_bins, **layout}, context={"instr": instr},
+              code=CODE["analysis"]),
+        Stage("plots", plots, deps=["mktcap", "annual_stats", "vol_trends", "missing"],
+              params={"paths": paths, "dpi": dpi, "fmt": fig_format},
+              context={"n_jobs": plot_jobs, "instr": instr}, outputs=list(paths.values()), code=CODE["plots"]),
+    ]
+    pipeline = Pipeline(stages, cache=cache, instrumentation=instr if instr.enabled else None)
+    if store_dir:
+        # Named after the panel's content key, so a store is never reused for different data
+        workers["store_path"] = os.path.join(store_dir, pipeline.keys["excess_returns"])
+    return pipeline
+
+
+def main(universe="sample", n_jobs=1, memory_budget_mb=1024, dpi=300, fig_format="png", compact=False,
+         instrumentation=None, cache=None, store_dir=None):
+    instr = instrumentation or Instrumentation(enabled=False)
+    pipeline = build_pipeline(universe=universe, n_jobs=n_jobs, memory_budget_mb=memory_budget_mb,
+                              dpi=dpi, fig_format=fig_format, compact=compact, cache=cache,
+                              instrumentation=instr, store_dir=store_dir)
+    results = pipeline.run(["desc_stats", "missing", "portfolios", "plots"])
+    print(f"Ran stages: {', '.join(pipeline.executed) or 'none (all cached)'}")
+
+    print(results["desc_stats"])
+
+    missing_summary = results["missing"].groupby('beta_period')['missing_pct'].describe()
+    print(missing_summary)
 
-    spread_ew_ivol = analyzer.compute_spread(ew_ivol, "ew_ret")
-    spread_vw_ivol = analyzer.compute_spread(vw_ivol, "vw_ret")
+    _, spreads = results["portfolios"]
+    print(f"Equal-weighted IVOL spread (Q5-Q1): {spreads[('IVOL_12m', 'ew')]:.6f}")
+    print(f"Value-weighted IVOL spread (Q5-Q1): {spreads[('IVOL_12m', 'vw')]:.6f}")
 
-    print(f"Equal-weighted IVOL spread (Q5-Q1): {spread_ew_ivol:.6f}")
-    print(f"Value-weighted IVOL spread (Q5-Q1): {spread_vw_ivol:.6f}")
+    if instr.enabled:
+        print(instr.summary())
+    return instr
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Estimate CAPM betas and volatility components from CRSP.")
+    parser.add_argument("--universe", choices=["sample", "all"], default="sample",
+                        help="estimate on the per-(year, industry) sample or on every PERMNO-month")
+    parser.add_argument("--n-jobs", type=int, default=1, help="worker processes for estimation (-1 for all cores)")
+    parser.add_argument("--memory-budget-mb", type=int, default=1024,
+                        help="memory budget for estimation, split between the --n-jobs processes: it bounds the "
+                             "PERMNO shards whose rolling moments are built at once and the query batches")
+    parser.add_argument("--compact", action="store_true",
+                        help="compact memory layout: projected columns, categorical identifiers, float32 returns")
+    parser.add_argument("--panel-store", nargs="?", const="cache/panels",
+                        help="export the panel to a memory-mapped store (default dir cache/panels) for the workers")
+    parser.add_argument("--dpi", type=int, default=300, help="resolution of the saved figures")
+    parser.add_argument("--figure-format", default="png", help="file format of the saved figures (png, pdf, svg, ...)")
+    parser.add_argument("--report", help="record per-stage timings and memory and write the run report (JSON) here")
+    parser.add_argument("--cprofile", action="store_true", help="with --report, dump a cProfile file per stage")
+    parser.add_argument("--tracemalloc", action="store_true", help="with --report, trace Python allocations per stage")
+    parser.add_argument("--artifact-cache", default="cache/artifacts",
+                        help="directory of memoized stage outputs")
+    parser.add_argument("--artifact-cache-gb", type=float, default=5.0,
+                        help="size limit of the artifact cache; least recently used artifacts are evicted")
+    parser.add_argument("--no-artifact-cache", action="store_true", help="recompute every stage")
+    args = parser.parse_args()
+    instr = Instrumentation(enabled=args.report is not None, profile=args.cprofile, trace_memory=args.tracemalloc)
+    cache = None if args.no_artifact_cache else ArtifactCache(args.artifact_cache, int(args.artifact_cache_gb * 2**30))
+    main(universe=args.universe, n_jobs=args.n_jobs, memory_budget_mb=args.memory_budget_mb,
+         dpi=args.dpi, fig_format=args.figure_format, compact=args.compact, instrumentation=instr, cache=cache,
+         store_dir=args.panel_store)
+    instr.write_report(args.report)
@@ -0,0 +1,106 @@
+import pandas as pd
+import numpy as np
+
+
+def to_days(dates):
+    """Convert an array-like of dates to integer days since the epoch."""
+    return np.asarray(pd.to_datetime(dates), dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+
+
+class PanelIndex():
+    def __init__(self, crsp, permno_col="PERMNO", date_col="date", store=None):
+        """Sort the CRSP panel by (PERMNO, date) once and build per-PERMNO offset tables.
+
+        store is an optional PanelStore written from this frame; columns it holds are
+        then read from its memory maps instead of sorted copies of the frame.
+        """
+        self.frame = crsp
+        self.store = store
+        self.stale = set()
+        permno = crsp[permno_col].to_numpy(dtype=np.int64)
+        days = to_days(crsp[date_col])
+        self.order = np.lexsort((days, permno))
+        self._build(permno[self.order], days[self.order])
+        if store is not None and (len(store) != len(self) or not np.array_equal(store.offsets, self.offsets)):
+            raise ValueError(f"panel store {store.path} was not written from this frame")
+
+    @classmethod
+    def from_sorted(cls, permno, days, columns):
+        """Build an index over arrays already sorted by (PERMNO, date), e.g. a shared-memory shard."""
+        index = cls.__new__(cls)
+        index.frame = None
+        index.store = None
+        index.stale = set()
+        index.order = None
+        index._build(np.asarray(permno, dtype=np.int64), np.asarray(days, dtype=np.int64))
+        index._columns.update(columns)
+        return index
+
+    def _build(self, permno, days):
+        """Offsets, group codes and search keys from (PERMNO, date)-sorted arrays."""
+        self.days = days
+        self.dates = self.days.astype("datetime64[D]")
+        self.permnos, starts, counts = np.unique(permno, return_index=True, return_counts=True)
+        self.offsets = np.append(starts, len(permno))
+        self.codes = np.repeat(np.arange(len(self.permnos), dtype=np.int64), counts)
+        # Single sorted key so one searchsorted resolves (PERMNO, date) windows
+        self.keys = (self.codes << 32) + (self.days + 2**31)
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    def column(self, name):
+        """Return a column of the panel as a contiguous array in (PERMNO, date) order."""
+        if name not in self._columns:
+            if self.store is not None and self.store.stores_values(name) and name not in self.stale:
+                return self.store.column(name)
+            self._columns[name] = np.ascontiguousarray(self.frame[name].to_numpy()[self.order])
+        return self._columns[name]
+
+    def column_rows(self, name, start=0, stop=None):
+        """Rows [start, stop) of a column in (PERMNO, date) order, without caching a sorted copy of it."""
+        if name in self._columns or self.frame is None or (self.store is not None and self.store.stores_values(name)
+                                                           and name not in self.stale):
+            return self.column(name)[start:stop]
+        return self.frame[name].to_numpy()[self.order[start:stop]]
+
+    def invalidate(self, *names):
+        """Drop cached sorted columns so they are re-read from the frame on next access."""
+        if self.store is not None:
+            # The frame changed since the store was written; its copies no longer apply
+            self.stale.update(names or self.store.columns)
+        for name in names or list(self._columns):
+            self._columns.pop(name, None)
+
+    def locate(self, permno):
+        """Return the [start, stop) rows of a PERMNO in sorted order (empty if absent)."""
+        code = np.searchsorted(self.permnos, permno)
+        if code == len(self.permnos) or self.permnos[code] != permno:
+            return 0, 0
+        return self.offsets[code], self.offsets[code + 1]
+
+    def window_bounds(self, permnos, start_dates, end_dates):
+        """Return [lo, hi) rows and PERMNO start rows of each (permno, start, end] window."""
+        permnos = np.asarray(permnos, dtype=np.int64)
+        codes = np.searchsorted(self.permnos, permnos)
+        codes = np.minimum(codes, len(self.permnos) - 1)
+        found = self.permnos[codes] == permnos if len(self.permnos) else np.zeros(len(permnos), bool)
+
+        base = codes << 32
+        lo = np.searchsorted(self.keys, base + to_days(start_dates) + 2**31, side="right")
+        hi = np.searchsorted(self.keys, base + to_days(end_dates) + 2**31, side="right")
+        lo = np.where(found, lo, 0)
+        hi = np.where(found, hi, 0)
+        return lo, hi, np.where(found, self.offsets[codes], 0)
+
+    def window(self, permno, start_date, end_date, columns=None):
+        """Return zero-copy views of the given columns for one PERMNO over (start, end]."""
+        start, stop = self.locate(permno)
+        days = self.days[start:stop]
+        lo = start + np.searchsorted(days, to_days([start_date])[0], side="right")
+        hi = start + np.searchsorted(days, to_days([end_date])[0], side="right")
+        columns = [] if columns is None else columns
+        views = {"date": self.dates[lo:hi]}
+        views.update({name: self.column(name)[lo:hi] for name in columns})
+        return views
@@ -0,0 +1,122 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+import shutil
+from panel_index import to_days
+
+
+def encode_column(series):
+    """NumPy values of a column and how to restore its pandas dtype; labels are stored as integer codes."""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == object or pd.api.types.is_string_dtype(dtype):
+        labels = series if isinstance(dtype, pd.CategoricalDtype) else series.astype("category")
+        return labels.cat.codes.to_numpy(), {"dtype": str(dtype), "categories": labels.cat.categories.tolist()}
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        # Nullable integers keep their width unless they hold missing values
+        if series.hasnans:
+            return series.to_numpy(dtype=np.float64, na_value=np.nan), {"dtype": str(dtype)}
+        return series.to_numpy(dtype=dtype.numpy_dtype), {"dtype": str(dtype)}
+    return series.to_numpy(), {"dtype": str(dtype)}
+
+
+class PanelStore():
+    def __init__(self, path):
+        """Open a store written by PanelStore.write; columns are memory-mapped read-only on first use."""
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.permnos = np.load(self.file("_permnos"))
+        self.offsets = np.load(self.file("_offsets"))
+        self._columns = {}
+
+    @classmethod
+    def write(cls, crsp, path, columns=None, permno_col="PERMNO", date_col="date", overwrite=False):
+        """Write a panel (PERMNO, date)-sorted as one .npy file per column plus a PERMNO offset index.
+
+        Rows are ordered exactly as PanelIndex orders the same frame. The store is
+        built in a scratch directory and renamed into place, so readers never see a
+        partial store; if another process wrote the same path first, its store is kept.
+        """
+        if os.path.exists(path) and not overwrite:
+            raise FileExistsError(f"{path} already exists; pass overwrite=True to rebuild it")
+        columns = list(dict.fromkeys([permno_col, date_col, *(crsp.columns if columns is None else columns)]))
+        permno = crsp[permno_col].to_numpy(dtype=np.int64)
+        days = to_days(crsp[date_col])
+        order = np.lexsort((days, permno))
+        permnos, starts = np.unique(permno[order], return_index=True)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "_permnos.npy"), permnos)
+        np.save(os.path.join(tmp_path, "_offsets.npy"), np.append(starts, len(order)))
+        np.save(os.path.join(tmp_path, "_days.npy"), days[order])
+        meta = {"rows": len(order), "permno_col": permno_col, "date_col": date_col, "columns": {}}
+        for name in columns:
+            values, meta["columns"][name] = encode_column(crsp[name])
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values[order])
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        if overwrite:
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                raise
+            shutil.rmtree(tmp_path)
+        return cls(path)
+
+    def file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def __contains__(self, name):
+        return name in self.meta["columns"]
+
+    @property
+    def columns(self):
+        return list(self.meta["columns"])
+
+    @property
+    def days(self):
+        """Integer days since the epoch of every row, memory-mapped."""
+        return self.column("_days")
+
+    def stores_values(self, name):
+        """Whether a column is stored as its own values rather than as category codes."""
+        return name in self and "categories" not in self.meta["columns"][name]
+
+    def column(self, name):
+        """Read-only memory map of a stored column (category codes for label columns)."""
+        if name not in self._columns:
+            self._columns[name] = np.load(self.file(name), mmap_mode="r")
+        return self._columns[name]
+
+    def locate(self, permno):
+        """Return the [start, stop) rows of a PERMNO (empty if absent)."""
+        code = np.searchsorted(self.permnos, permno)
+        if code == len(self.permnos) or self.permnos[code] != permno:
+            return 0, 0
+        return int(self.offsets[code]), int(self.offsets[code + 1])
+
+    def frame(self, columns=None, permnos=None):
+        """Materialize (the rows of some PERMNOs of) the panel as a DataFrame with its original dtypes."""
+        columns = self.columns if columns is None else columns
+        if permnos is None:
+            rows = slice(None)
+        else:
+            rows = np.concatenate([np.arange(*self.locate(p)) for p in permnos] or [np.array([], dtype=np.int64)])
+        data = {}
+        for name in columns:
+            spec = self.meta["columns"][name]
+            values = np.asarray(self.column(name)[rows])
+            if "categories" in spec:
+                values = pd.Categorical.from_codes(values, categories=spec["categories"])
+            data[name] = pd.Series(values).astype(spec["dtype"])
+        return pd.DataFrame(data)
@@ -0,0 +1,165 @@
+import numpy as np
+import contextlib
+import functools
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from panel_index import PanelIndex
+from panel_store import PanelStore
+from rolling import RollingMoments, run_batched
+
+
+class SharedPanel():
+    def __init__(self, arrays):
+        """Copy (PERMNO, date)-sorted panel arrays into named shared memory blocks."""
+        self.blocks = []
+        self.spec = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+            self.blocks.append(shm)
+            self.spec[name] = (shm.name, arr.shape, arr.dtype.str)
+
+    @classmethod
+    def from_index(cls, index, columns):
+        """Share the sorted PERMNO, date and value columns of a PanelIndex."""
+        arrays = {"permno": index.permnos[index.codes], "days": index.days}
+        # Gathered on the fly: the blocks hold the sorted columns, so the index need not keep copies too
+        arrays.update({name: index.column_rows(name) for name in columns})
+        return cls(arrays)
+
+    def close(self):
+        """Release and unlink every block."""
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(spec):
+    """Map shared blocks back to NumPy arrays without copying."""
+    blocks, arrays = [], {}
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return blocks, arrays
+
+
+def _index_shard(index, columns, rows, kernel, queries, params, batch_size=None):
+    """In-process entry point: gather one PERMNO range of the index and run the kernel on it."""
+    r0, r1 = rows
+    arrays = {"permno": index.permnos[index.codes[r0:r1]], "days": index.days[r0:r1]}
+    arrays.update({name: index.column_rows(name, r0, r1) for name in columns})
+    return _shard_columns(arrays, (0, r1 - r0), kernel, queries, params, batch_size)
+
+
+def _shard_columns(arrays, rows, kernel, queries, params, batch_size):
+    r0, r1 = rows
+    columns = {name: arr[r0:r1] for name, arr in arrays.items() if name not in ("permno", "days")}
+    index = PanelIndex.from_sorted(arrays["permno"][r0:r1], arrays["days"][r0:r1], columns)
+    return run_batched(kernel, RollingMoments(index), queries, params, batch_size)
+
+
+def _run_shard(spec, rows, kernel, queries, params, batch_size=None):
+    """Worker entry point: attach the shared panel, run the kernel on one PERMNO range."""
+    blocks, arrays = attach(spec)
+    try:
+        return _shard_columns(arrays, rows, kernel, queries, params, batch_size)
+    finally:
+        # Views into the blocks must be gone before the mappings can be closed
+        del arrays
+        for shm in blocks:
+            shm.close()
+
+
+def _run_store_shard(path, columns, rows, kernel, queries, params, batch_size=None):
+    """Worker entry point: memory-map the columns of a PanelStore, run the kernel on one PERMNO range."""
+    store = PanelStore(path)
+    arrays = {"permno": store.column(store.meta["permno_col"]), "days": store.days}
+    arrays.update({name: store.column(name) for name in columns})
+    return _shard_columns(arrays, rows, kernel, queries, params, batch_size)
+
+
+def _run_now(func, *args):
+    """Run func in this process and wrap its result like a pool's future."""
+    future = Future()
+    future.set_result(func(*args))
+    return future
+
+
+def store_columns(index, columns):
+    """Whether workers can read every column from the index's PanelStore instead of shared copies."""
+    return index.store is not None and all(index.store.stores_values(name) and name not in index.stale
+                                           for name in columns)
+
+
+def shard_bounds(index, n_shards, max_rows=None):
+    """Split PERMNO codes into contiguous ranges holding roughly equal numbers of rows.
+
+    With max_rows, enough ranges are made that each holds about max_rows rows or fewer
+    (ranges end at PERMNO boundaries, so a range can exceed it by part of one PERMNO).
+    """
+    if max_rows:
+        n_shards = max(n_shards, -(-len(index) // max_rows))
+    targets = np.linspace(0, len(index), n_shards + 1)
+    return np.unique(np.searchsorted(index.offsets, targets))
+
+
+def run_sharded(index, kernel, queries, params, columns=("excess_mkt", "excess_stock"),
+                n_jobs=-1, shards_per_job=4, batch_size=None, max_shard_rows=None):
+    """Run a rolling-window kernel over PERMNO shards in a process pool and reassemble the results.
+
+    Each query keeps its original position, so the output is identical to running
+    the kernel on the whole panel, whatever the number of workers. batch_size bounds
+    the number of queries each worker evaluates at once and max_shard_rows the panel
+    rows whose rolling moments it builds at once. With n_jobs=1 the shards run one
+    after another in this process. When the index is backed by a PanelStore holding
+    the columns, workers memory-map it read-only (sharing the OS page cache) instead
+    of receiving copies in shared memory.
+    """
+    n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+    n_shards = 1 if n_jobs == 1 else max(1, min(len(index.permnos), n_jobs * shards_per_job))
+    bounds = shard_bounds(index, n_shards, max_shard_rows)
+
+    permnos = np.asarray(queries["permnos"], dtype=np.int64)
+    codes = np.searchsorted(index.permnos, permnos)
+    shard = np.clip(np.searchsorted(bounds, codes, side="right") - 1, 0, len(bounds) - 2)
+
+    if n_jobs == 1:
+        panel, pool = contextlib.nullcontext(), contextlib.nullcontext()
+        worker = functools.partial(_index_shard, index, list(columns))
+    else:
+        if store_columns(index, columns):
+            panel = contextlib.nullcontext()
+            worker = functools.partial(_run_store_shard, index.store.path, list(columns))
+        else:
+            panel = SharedPanel.from_index(index, columns)
+            worker = functools.partial(_run_shard, panel.spec)
+        pool = ProcessPoolExecutor(max_workers=n_jobs)
+    submit = _run_now if n_jobs == 1 else pool.submit
+
+    out = {}
+    with panel, pool:
+        jobs = []
+        for i in range(len(bounds) - 1):
+            pos = np.flatnonzero(shard == i)
+            if len(pos) == 0:
+                continue
+            rows = (int(index.offsets[bounds[i]]), int(index.offsets[bounds[i + 1]]))
+            shard_queries = {name: np.asarray(values)[pos] for name, values in queries.items()}
+            jobs.append((pos, submit(worker, rows, kernel, shard_queries, params, batch_size)))
+
+        for pos, job in jobs:
+            for name, values in job.result().items():
+                if name not in out:
+                    out[name] = np.full(len(permnos), np.nan)
+                out[name][pos] = values
+    return out
@@ -0,0 +1,170 @@
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+
+
+class Stage():
+    def __init__(self, name, func, deps=(), params=None, context=None, outputs=(), cache=True, code=()):
+        """A named pipeline step: func(*dep_values, **params, **context) -> artifact.
+
+        params are part of the cache key; context (e.g. worker counts, instrumentation)
+        is passed along but does not change the result, so it is not. code names the
+        modules func delegates its work to (e.g. ["analysis"]); their source is part of
+        the key along with func's own. outputs lists files the stage writes; a cached
+        result is only reused while they all exist. cache=False always re-runs the stage.
+        """
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.context = context or {}
+        self.outputs = list(outputs)
+        self.cache = cache
+        self.code = list(code)
+
+
+class ArtifactCache():
+    def __init__(self, cache_dir="cache/artifacts", max_bytes=5 * 2**30):
+        """Pickled stage artifacts on disk, evicted least-recently-used beyond max_bytes."""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, key):
+        """Read an artifact and mark it as recently used."""
+        path = self.path(key)
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+        os.utime(path)
+        return value
+
+    def store(self, key, value):
+        """Write an artifact atomically, then evict old ones if over budget."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Delete the least recently used artifacts until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(self.cache_dir, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+
+def module_digest(name):
+    """Hash of a module's source file, located without importing it."""
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.origin or not os.path.exists(spec.origin):
+        raise ValueError(f"cannot find the source of module {name!r}")
+    with open(spec.origin, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def stage_key(stage, dep_keys):
+    """Content key of a stage from its code, parameters and the keys of its inputs."""
+    try:
+        source = inspect.getsource(stage.func)
+    except (OSError, TypeError):
+        source = getattr(stage.func, "__qualname__", repr(stage.func))
+    modules = {name: module_digest(name) for name in stage.code}
+    payload = json.dumps([stage.name, source, modules, stage.params, dep_keys], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+
+class Pipeline():
+    def __init__(self, stages, cache=None, instrumentation=None):
+        """A DAG of stages whose artifacts are memoized on disk by content key.
+
+        Keys chain through the DAG (each key covers the keys of its inputs), so
+        every stage downstream of a changed input, parameter or stage function gets
+        a new key. run() resolves targets lazily: a cached stage is loaded without
+        touching its inputs, and only stages with a new key are executed.
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache = cache
+        self.instrumentation = instrumentation
+        self.keys = {}
+        self.values = {}
+        self.executed = []
+        self.targets = set()
+        # Consumers still to run per stage; an artifact is dropped from memory once none are left
+        self.pending = {name: 0 for name in self.stages}
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                self.pending[dep] += 1
+        for name in self.stages:
+            self.key(name)
+
+    def key(self, name, _visiting=()):
+        if name not in self.keys:
+            if name in _visiting:
+                raise ValueError(f"cycle in pipeline at stage {name!r}")
+            stage = self.stages[name]
+            dep_keys = [self.key(dep, _visiting + (name,)) for dep in stage.deps]
+            self.keys[name] = stage_key(stage, dep_keys)
+        return self.keys[name]
+
+    def cached(self, stage):
+        return (self.cache is not None and stage.cache and self.keys[stage.name] in self.cache
+                and all(os.path.exists(path) for path in stage.outputs))
+
+    def value(self, name):
+        """Artifact of a stage, from memory, the disk cache or by running it."""
+        if name in self.values:
+            return self.values[name]
+        stage = self.stages[name]
+        if self.cached(stage):
+            value = self.cache.load(self.keys[name])
+        else:
+            inputs = [self.value(dep) for dep in stage.deps]
+            if self.instrumentation is not None:
+                with self.instrumentation.stage(name):
+                    value = stage.func(*inputs, **stage.params, **stage.context)
+            else:
+                value = stage.func(*inputs, **stage.params, **stage.context)
+            self.executed.append(name)
+            if self.cache is not None and stage.cache:
+                self.cache.store(self.keys[name], value)
+            del inputs
+            self.release(stage.deps)
+        self.values[name] = value
+        return value
+
+    def release(self, deps):
+        """Forget the in-memory artifacts of inputs that no remaining stage needs."""
+        for dep in deps:
+            self.pending[dep] -= 1
+            if self.pending[dep] == 0 and dep not in self.targets:
+                self.values.pop(dep, None)
+
+    def sinks(self):
+        """Stages no other stage depends on."""
+        used = {dep for stage in self.stages.values() for dep in stage.deps}
+        return [name for name in self.stages if name not in used]
+
+    def run(self, targets=None):
+        """Resolve the target stages (the sinks by default) and return their artifacts by name."""
+        targets = self.sinks() if targets is None else list(targets)
+        self.targets.update(targets)
+        return {name: self.value(name) for name in targets}
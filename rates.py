@@ -0,0 +1,108 @@
+import pandas as pd
+import datetime as dt
+import json
+import os
+import warnings
+
+
+def read_rate_file(path):
+    """Read a (date, rf) series stored as CSV or Parquet."""
+    if path.endswith(".parquet"):
+        rf = pd.read_parquet(path)
+    else:
+        rf = pd.read_csv(path)
+    rf = rf[['date', 'rf']]
+    rf['date'] = pd.to_datetime(rf['date'])
+    return rf
+
+
+def write_rate_file(rf, path):
+    """Write a (date, rf) series as CSV or Parquet depending on the extension."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    if path.endswith(".parquet"):
+        rf.to_parquet(tmp_path, index=False)
+    else:
+        rf.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+class FredRateSource():
+    def __init__(self, api_key, series_id="DTB3"):
+        """Risk-free rate fetched live from FRED; the client is only created on first fetch."""
+        self.api_key = api_key
+        self.series_id = series_id
+        self._fred = None
+
+    def get(self):
+        """Fetch the full series from FRED as a (date, rf) frame."""
+        if self._fred is None:
+            # Imported here so runs served from a cache or a local file never load the client
+            from fredapi import Fred
+            self._fred = Fred(api_key=self.api_key)
+        rf = self._fred.get_series(self.series_id).reset_index()
+        rf.columns = ['date', 'rf']
+        rf['date'] = pd.to_datetime(rf['date'])
+        return rf
+
+
+class LocalFileRateSource():
+    def __init__(self, path):
+        """Risk-free rate read from a local CSV/Parquet file only; never touches the network."""
+        self.path = path
+
+    def get(self):
+        """Read the series from disk."""
+        return read_rate_file(self.path)
+
+
+class CachedRateSource():
+    def __init__(self, source, cache_path, ttl_days: float = 1.0):
+        """File-backed cache in front of another source, refreshed once it is older than the TTL."""
+        self.source = source
+        self.cache_path = cache_path
+        self.meta_path = cache_path + ".json"
+        self.ttl = dt.timedelta(days=ttl_days)
+
+    def fetched_at(self):
+        """Timestamp of the cached copy, or None if there is no cache yet."""
+        if not (os.path.exists(self.cache_path) and os.path.exists(self.meta_path)):
+            return None
+        with open(self.meta_path, 'r') as f:
+            return dt.datetime.fromisoformat(json.load(f)['fetched_at'])
+
+    def is_fresh(self):
+        fetched_at = self.fetched_at()
+        return fetched_at is not None and dt.datetime.now(dt.timezone.utc) - fetched_at < self.ttl
+
+    def refresh(self):
+        """Fetch from the underlying source and rewrite the cache."""
+        rf = self.source.get()
+        write_rate_file(rf, self.cache_path)
+        with open(self.meta_path, 'w') as f:
+            json.dump({'fetched_at': dt.datetime.now(dt.timezone.utc).isoformat()}, f)
+        return rf
+
+    def get(self):
+        """Serve the cached series, refreshing it only when stale; fall back to a stale copy offline."""
+        if self.is_fresh():
+            return read_rate_file(self.cache_path)
+        try:
+            return self.refresh()
+        except Exception as e:
+            if self.fetched_at() is None:
+                raise
+            warnings.warn(f"Could not refresh risk-free rate ({e}); using cache from {self.fetched_at()}")
+            return read_rate_file(self.cache_path)
+
+
+def rate_source_from_config(config, cache_dir="cache"):
+    """Build the risk-free rate source described by the optional `risk_free` config section."""
+    rf_config = config.get('risk_free', {}) or {}
+    if rf_config.get('source') == 'file':
+        return LocalFileRateSource(rf_config['path'])
+
+    series_id = rf_config.get('series', 'DTB3')
+    fred = FredRateSource(config['api_keys']['fred'], series_id=series_id)
+    cache_path = rf_config.get('path', os.path.join(cache_dir, f"{series_id}.csv"))
+    return CachedRateSource(fred, cache_path, ttl_days=rf_config.get('ttl_days', 1.0))
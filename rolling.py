@@ -0,0 +1,132 @@
+import pandas as pd
+import numpy as np
+
+# Peak bytes per panel row while RollingMoments is built (sorted inputs, 13 float64 moments, their cumsum)
+MOMENT_BYTES = 320
+
+
+class RollingMoments():
+    def __init__(self, index, x_col="excess_mkt", y_col="excess_stock", moments=None):
+        """Build within-PERMNO cumulative sums of the OLS moments over a PanelIndex.
+
+        moments optionally replaces the OLS moments with other per-row statistics
+        (a dict of arrays in the index's sorted order), e.g. for lagged regressors.
+        """
+        self.index = index
+        if moments is None:
+            moments = self.ols_moments(index, x_col, y_col)
+        # Cumulate within each PERMNO so sums never carry the magnitude of the whole panel
+        cum = pd.DataFrame(moments, dtype=np.float64).groupby(index.codes, sort=False).cumsum()
+        self.cum = {name: cum[name].to_numpy() for name in cum.columns}
+
+    @staticmethod
+    def ols_moments(index, x_col, y_col):
+        """Per-row pairwise and marginal moments of the x and y columns."""
+        x = index.column(x_col).astype(np.float64)
+        y = index.column(y_col).astype(np.float64)
+
+        has_x = ~np.isnan(x)
+        has_y = ~np.isnan(y)
+        valid = has_x & has_y
+        x0 = np.where(has_x, x, 0.0)
+        y0 = np.where(has_y, y, 0.0)
+        xv = np.where(valid, x0, 0.0)
+        yv = np.where(valid, y0, 0.0)
+        return {
+            # Pairwise moments over rows where both returns are present (OLS, residuals)
+            "n": valid, "x": xv, "y": yv, "xx": xv * xv, "xy": xv * yv, "yy": yv * yv,
+            # Marginal moments over all rows of each series (NaN-skipping variances)
+            "rows": np.ones(len(x)), "nx": has_x, "sx": x0, "sxx": x0 * x0,
+            "ny": has_y, "sy": y0, "syy": y0 * y0,
+        }
+
+    def window_sums(self, permnos, start_dates, end_dates, names=None):
+        """Return the moment sums over each (permno, start, end] window as a dict of arrays."""
+        return self.sums(self.index.window_bounds(permnos, start_dates, end_dates), names)
+
+    def sums(self, bounds, names=None):
+        """Moment sums over windows already resolved by PanelIndex.window_bounds."""
+        lo, hi, first = bounds
+        names = self.cum.keys() if names is None else names
+        return {name: self._prefix(self.cum[name], hi, first) - self._prefix(self.cum[name], lo, first)
+                for name in names}
+
+    @staticmethod
+    def _prefix(cum, k, first):
+        """Sum of rows [first, k) from the within-group inclusive cumulative sums."""
+        return np.where(k > first, cum[np.maximum(k - 1, 0)], 0.0)
+
+
+def ols_from_sums(sums, min_obs=3):
+    """Closed-form univariate OLS slope and intercept from window moment sums."""
+    n, sx, sy = sums["n"], sums["x"], sums["y"]
+    sxx = n * sums["xx"] - sx * sx
+    sxy = n * sums["xy"] - sx * sy
+    ok = (n >= min_obs) & (sxx > 0)
+
+    beta = np.full(len(n), np.nan)
+    alpha = np.full(len(n), np.nan)
+    beta[ok] = sxy[ok] / sxx[ok]
+    alpha[ok] = (sy[ok] - beta[ok] * sx[ok]) / n[ok]
+    return beta, alpha
+
+
+def volatilities_from_sums(sums, beta, min_rows=3):
+    """Total, systematic and idiosyncratic volatility from window moment sums and a given beta."""
+    def variance(n, s, ss):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            var = (ss - s * s / n) / (n - 1)
+        return np.where(n >= 2, np.maximum(var, 0.0), np.nan)
+
+    beta = np.asarray(beta, dtype=np.float64)
+    ok = (sums["rows"] >= min_rows) & ~np.isnan(beta)
+    var_stock = variance(sums["ny"], sums["sy"], sums["syy"])
+    var_mkt = variance(sums["nx"], sums["sx"], sums["sxx"])
+    resid = sums["y"] - beta * sums["x"]
+    resid_sq = sums["yy"] - 2 * beta * sums["xy"] + beta * beta * sums["xx"]
+    var_resid = variance(sums["n"], resid, resid_sq)
+
+    tvol = np.where(ok, np.sqrt(var_stock), np.nan)
+    svol = np.where(ok, beta * np.sqrt(var_mkt), np.nan)
+    ivol = np.where(ok, np.sqrt(var_resid), np.nan)
+    return tvol, svol, ivol
+
+
+def window_starts(end_dates, lookback):
+    """Exclusive window starts `lookback` months before each end date."""
+    return pd.DatetimeIndex(end_dates) - pd.DateOffset(months=lookback)
+
+
+def beta_columns(moments, permnos, end_dates, lookbacks):
+    """beta_{lb}m / alpha_{lb}m arrays for each (permno, end date) query and lookback."""
+    columns = {}
+    for lb in lookbacks:
+        sums = moments.window_sums(permnos, window_starts(end_dates, lb), end_dates)
+        columns[f"beta_{lb}m"], columns[f"alpha_{lb}m"] = ols_from_sums(sums)
+    return columns
+
+
+def volatility_columns(moments, permnos, end_dates, lookbacks, betas):
+    """TVOL/SVOL/IVOL arrays for each query and lookback; betas has one column per lookback."""
+    columns = {}
+    for i, lb in enumerate(lookbacks):
+        sums = moments.window_sums(permnos, window_starts(end_dates, lb), end_dates)
+        tvol, svol, ivol = volatilities_from_sums(sums, betas[:, i])
+        columns[f"TVOL_{lb}m"], columns[f"SVOL_{lb}m"], columns[f"IVOL_{lb}m"] = tvol, svol, ivol
+    return columns
+
+
+def run_batched(kernel, moments, queries, params, batch_size=None):
+    """Run a kernel over consecutive query batches so window temporaries stay bounded."""
+    n = len(queries["permnos"])
+    if batch_size is None or n <= batch_size:
+        return kernel(moments, **queries, **params)
+
+    out = {}
+    for lo in range(0, n, batch_size):
+        batch = {name: values[lo:lo + batch_size] for name, values in queries.items()}
+        for name, values in kernel(moments, **batch, **params).items():
+            if name not in out:
+                out[name] = np.empty(n, dtype=values.dtype)
+            out[name][lo:lo + batch_size] = values
+    return out
@@ -0,0 +1,216 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from data_processor import PreProcessor
+from feature_eng import FeatureEngineer
+from panel_index import to_days
+from rolling import ols_from_sums, volatilities_from_sums, window_starts
+
+FIELDS = ["beta", "alpha", "TVOL", "SVOL", "IVOL", "n_obs"]
+
+
+class BetaService():
+    def __init__(self, feature_eng, cache_size=100_000, latency_window=10_000):
+        """Answer (PERMNO, as-of date, lookback) beta/volatility queries from precomputed rolling sums.
+
+        The within-PERMNO cumulative moments of feature_eng's excess-return panel are
+        built once, so each query is a few binary searches over them. Windows are
+        (date - lookback months, date], and volatilities use the beta of the same
+        window, so no estimate looks past its as-of date. Recent results are kept in an
+        LRU cache of at most cache_size entries.
+        """
+        self.moments = feature_eng.rolling_moments()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        # Latency of the most recent requests (a batch counts as one request)
+        self.latencies = deque(maxlen=latency_window)
+        self.counts = {"requests": 0, "queries": 0, "hits": 0, "misses": 0, "evictions": 0}
+        self.busy_seconds = 0.0
+        self.started = time.time()
+
+    @classmethod
+    def from_csv(cls, file_path='MSF_1996_2023.csv', compact=False, preprocessor=None, **kwargs):
+        """Load the cleaned panel once (through the Parquet cache) and index it for queries."""
+        preprocessor = preprocessor or PreProcessor(compact_layout=compact)
+        crsp = preprocessor.load_data(file_path)
+        feature_eng = FeatureEngineer(crsp, crsp, universe="all", compact_layout=compact)
+        feature_eng.excess_returns()
+        return cls(feature_eng, **kwargs)
+
+    def compute(self, permnos, end_dates, lookbacks):
+        """Estimates for arrays of queries as a dict of FIELDS arrays, bypassing the cache."""
+        out = {name: np.full(len(permnos), np.nan) for name in FIELDS}
+        for lb in np.unique(lookbacks):
+            rows = np.flatnonzero(lookbacks == lb)
+            ends = end_dates[rows]
+            sums = self.moments.window_sums(permnos[rows], window_starts(ends, int(lb)), ends)
+            beta, alpha = ols_from_sums(sums)
+            tvol, svol, ivol = volatilities_from_sums(sums, beta)
+            for name, values in zip(FIELDS, [beta, alpha, tvol, svol, ivol, sums["n"]]):
+                out[name][rows] = values
+        return out
+
+    def query_batch(self, permnos, dates, lookbacks=12):
+        """Estimates for many (PERMNO, date, lookback) queries, served from the cache where possible.
+
+        dates and lookbacks may be single values shared by every PERMNO. Returns one
+        dict per query with the FIELDS (None where undetermined).
+        """
+        start = time.perf_counter()
+        permnos = np.atleast_1d(np.asarray(permnos, dtype=np.int64))
+        end_dates = pd.to_datetime(np.atleast_1d(dates)).to_numpy(dtype="datetime64[ns]")
+        lookbacks = np.atleast_1d(np.asarray(lookbacks, dtype=np.int64))
+        permnos, end_dates, lookbacks = np.broadcast_arrays(permnos, end_dates, lookbacks)
+        if np.any(lookbacks <= 0):
+            raise ValueError("lookbacks must be positive numbers of months")
+
+        keys = list(zip(permnos.tolist(), to_days(end_dates).tolist(), lookbacks.tolist()))
+        results = [None] * len(keys)
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    results[i] = self.cache[key]
+        missing = np.array([i for i, result in enumerate(results) if result is None], dtype=np.int64)
+
+        if len(missing):
+            out = self.compute(permnos[missing], end_dates[missing], lookbacks[missing])
+            computed = np.column_stack([out[name] for name in FIELDS])
+            with self.lock:
+                for i, values in zip(missing.tolist(), computed.tolist()):
+                    results[i] = self.cache[keys[i]] = tuple(values)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                    self.counts["evictions"] += 1
+
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["queries"] += len(keys)
+            self.counts["hits"] += len(keys) - len(missing)
+            self.counts["misses"] += len(missing)
+            self.busy_seconds += elapsed
+            self.latencies.append(elapsed)
+
+        return [{"PERMNO": permno, "date": str(np.datetime64(day, "D")), "lookback": lb,
+                 **{name: None if np.isnan(value) else (int(value) if name == "n_obs" else value)
+                    for name, value in zip(FIELDS, result)}}
+                for (permno, day, lb), result in zip(keys, results)]
+
+    def query(self, permno, date, lookback=12):
+        """Estimates for a single PERMNO as of a date over the trailing lookback months."""
+        return self.query_batch([permno], [date], [lookback])[0]
+
+    def stats(self):
+        """Query counts, cache hit rate, request latency percentiles (ms) and throughput."""
+        with self.lock:
+            counts = dict(self.counts)
+            latencies = np.array(self.latencies) * 1000
+            busy = self.busy_seconds
+            entries = len(self.cache)
+        latency = {"p50": None, "p95": None, "p99": None, "max": None}
+        if len(latencies):
+            latency = dict(zip(["p50", "p95", "p99"], np.percentile(latencies, [50, 95, 99]).tolist()),
+                           max=float(latencies.max()))
+        return {**counts, "uptime_seconds": time.time() - self.started,
+                "hit_rate": counts["hits"] / counts["queries"] if counts["queries"] else None,
+                "cache_entries": entries, "cache_size": self.cache_size, "latency_ms": latency,
+                "queries_per_busy_sec": counts["queries"] / busy if busy > 0 else None}
+
+
+def make_handler(service):
+    """HTTP handler: GET /beta?permno=&date=&lookback=, POST /batch (JSON) and GET /stats."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                return self.reply(200, service.stats())
+            if url.path != "/beta":
+                return self.reply(404, {"error": f"unknown path {url.path}"})
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            try:
+                result = service.query(int(params["permno"]), params["date"], int(params.get("lookback", 12)))
+            except (KeyError, ValueError) as e:
+                return self.reply(400, {"error": f"expected permno, date and lookback parameters: {e}"})
+            self.reply(200, result)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/batch":
+                return self.reply(404, {"error": f"unknown path {self.path}"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                results = service.query_batch(body["permnos"], body["dates"], body.get("lookbacks", 12))
+            except (KeyError, ValueError, TypeError) as e:
+                return self.reply(400, {"error": f"expected JSON with permnos, dates and lookbacks: {e}"})
+            self.reply(200, results)
+
+        def reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Per-request logging would dominate the latency; /stats reports on the traffic instead
+            pass
+
+    return Handler
+
+
+def serve(service, host="127.0.0.1", port=8765):
+    """Serve queries over HTTP until interrupted."""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving beta queries on http://{host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def repl(service, lines=sys.stdin, out=sys.stdout):
+    """Answer one query per input line ("PERMNO DATE [LOOKBACK]", or "stats") with a line of JSON."""
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        try:
+            if fields == ["stats"]:
+                result = service.stats()
+            else:
+                result = service.query(int(fields[0]), fields[1], int(fields[2]) if len(fields) > 2 else 12)
+        except (IndexError, ValueError) as e:
+            result = {"error": f"expected 'PERMNO DATE [LOOKBACK]' or 'stats': {e}"}
+        print(json.dumps(result), file=out, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve interactive beta/volatility queries on the CRSP panel.")
+    parser.add_argument("--file", default='MSF_1996_2023.csv', help="CRSP CSV (read through the Parquet cache)")
+    parser.add_argument("--compact", action="store_true", help="load the panel in the compact memory layout")
+    parser.add_argument("--cache-size", type=int, default=100_000, help="query results kept in the LRU cache")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stdin", action="store_true", help="answer queries from stdin instead of over HTTP")
+    args = parser.parse_args()
+
+    service = BetaService.from_csv(args.file, compact=args.compact, cache_size=args.cache_size)
+    if args.stdin:
+        repl(service)
+    else:
+        serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
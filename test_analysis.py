@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from analysis import Analysis
+
+
+def reference_codes(values, periods, n_bins):
+    """pd.qcut(labels=False, duplicates="drop") + 1 applied period by period."""
+    out = np.full(len(values), np.nan)
+    for period in np.unique(periods):
+        rows = np.flatnonzero(periods == period)
+        s = pd.Series(values[rows])
+        if s.notna().any():
+            out[rows] = pd.qcut(s, n_bins, labels=False, duplicates="drop").to_numpy(dtype=np.float64) + 1
+    return out
+
+
+def random_case(rng):
+    """Periods of varied sizes with ties, NaNs, single-value and all-NaN periods."""
+    sizes = rng.integers(1, 40, rng.integers(1, 12))
+    periods = np.repeat(rng.permutation(len(sizes)), sizes)
+    kind = rng.integers(0, 3)
+    if kind == 0:
+        values = rng.normal(size=len(periods))
+    elif kind == 1:
+        # Heavy ties, as in rounded or censored betas
+        values = rng.integers(0, 4, len(periods)).astype(np.float64)
+    else:
+        values = np.round(rng.normal(size=len(periods)), 1)
+    values[rng.random(len(values)) < 0.15] = np.nan
+    constant = periods == periods[0]
+    values[constant] = rng.choice([values[constant][0], 1.5])
+    if len(sizes) > 2:
+        values[periods == periods[-1]] = np.nan
+    return values, periods
+
+
+def test_qcut_codes_matches_pandas_qcut():
+    rng = np.random.default_rng(0)
+    for case in range(1000):
+        values, periods = random_case(rng)
+        n_bins = int(rng.integers(2, 11))
+        np.testing.assert_array_equal(Analysis.qcut_codes(values, periods, n_bins),
+                                      reference_codes(values, periods, n_bins), err_msg=f"case {case}")
+
+
+def test_qcut_codes_on_sorted_and_unsorted_periods():
+    values = np.array([3.0, 1.0, 2.0, np.nan, 5.0, 4.0, 4.0, 0.0])
+    periods = np.array([1, 0, 1, 0, 0, 1, 0, 1])
+    np.testing.assert_array_equal(Analysis.qcut_codes(values, periods, 2), reference_codes(values, periods, 2))
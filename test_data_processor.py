@@ -0,0 +1,118 @@
+import warnings
+import numpy as np
+import pandas as pd
+from benchmark import SyntheticRateSource, make_synthetic_crsp
+from data_processor import PreProcessor
+
+DIRTY_RETURNS = ["C", "B", "A", "", " ", "-66.0", "0.0123X", "0.0123", "-0.5", "+.5", "1e5", "1E-3",
+                 "1e400", "-1e400", "1e-400", "1,234", "1.2.3", "--1", "e", ".", "nan", "inf", "12%", "(0.05)"]
+
+
+def assert_same_returns(values):
+    s = pd.Series(values, dtype="string")
+    expected = s.apply(PreProcessor.clean_numeric).astype(np.float64)
+    pd.testing.assert_series_equal(PreProcessor.clean_numeric_series(s), expected, check_names=False)
+
+
+def test_clean_numeric_series_matches_scalar_on_dirty_returns():
+    assert_same_returns(DIRTY_RETURNS + [pd.NA, None])
+
+
+def test_clean_numeric_series_matches_scalar_on_random_strings():
+    rng = np.random.default_rng(0)
+    alphabet = np.array(list("0123456789eE.-+xCB "))
+    values = ["".join(rng.choice(alphabet, rng.integers(0, 9))) for _ in range(5000)]
+    assert_same_returns(values)
+
+
+def test_clean_numeric_series_keeps_index():
+    s = pd.Series(["0.1", "C", pd.NA], index=[10, 5, 7], dtype="string")
+    assert list(PreProcessor.clean_numeric_series(s).index) == [10, 5, 7]
+
+
+def assert_same_industries(codes):
+    s = pd.Series(codes, dtype="string")
+    expected = [PreProcessor.map_sic_to_industry(code) for code in codes]
+    assert PreProcessor.map_sic_series(s).astype(object).tolist() == expected
+
+
+def test_map_sic_series_matches_scalar_on_every_code():
+    assert_same_industries([str(code) for code in range(12000)])
+    # CRSP writes SIC codes zero-padded to four digits
+    assert_same_industries([f"{code:04d}" for code in range(12000)])
+
+
+def test_map_sic_series_matches_scalar_on_non_digits():
+    assert_same_industries(["", " ", "Z", "12a", " 123", "123 ", "-100", "+5", "1.5", "1e3", "99999999999999999999"])
+
+
+def test_map_sic_series_maps_missing_to_other():
+    # The scalar version cannot take NA (it calls str.isdigit); missing codes are not industries
+    s = pd.Series(["2834", pd.NA, None], dtype="string")
+    assert PreProcessor.map_sic_series(s).astype(object).tolist() == ["Manufacturing", "Other", "Other"]
+
+
+def test_stream_data_cleans_chunks_without_copy_warnings(tmp_path):
+    csv_path = str(tmp_path / "msf.csv")
+    make_synthetic_crsp(n_permnos=40, n_months=48).to_csv(csv_path, index=False)
+    preprocessor = PreProcessor(rate_source=SyntheticRateSource(), cache_dir=str(tmp_path / "cache"))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", pd.errors.SettingWithCopyWarning)
+        preprocessor.stream_data(csv_path, str(tmp_path / "store"), chunksize=300)
+
+    columns = ["PERMNO", "date", "RET", "RETX", "rf", "industry"]
+    streamed = preprocessor.read_store(str(tmp_path / "store"))[columns]
+    loaded = preprocessor.load_data(csv_path)[columns]
+    pd.testing.assert_frame_equal(streamed.sort_values(["PERMNO", "date"]).reset_index(drop=True),
+                                  loaded.sort_values(["PERMNO", "date"]).reset_index(drop=True))
+
+
+def expected_rf(crsp, source):
+    rf = PreProcessor(rate_source=source).risk_free_rate()
+    return PreProcessor.attach_risk_free(crsp[["date"]].copy(), rf)["rf"]
+
+
+def test_load_data_joins_current_risk_free_rate(tmp_path):
+    csv_path = str(tmp_path / "msf.csv")
+    make_synthetic_crsp(n_permnos=20, n_months=36).to_csv(csv_path, index=False)
+    cache_dir = str(tmp_path / "cache")
+
+    first = PreProcessor(rate_source=SyntheticRateSource(seed=0), cache_dir=cache_dir).load_data(csv_path)
+    refreshed = PreProcessor(rate_source=SyntheticRateSource(seed=1), cache_dir=cache_dir)
+    second = refreshed.load_data(csv_path)
+
+    # The second load is a cache hit, yet it carries the new rate
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+    pd.testing.assert_series_equal(first["rf"], expected_rf(first, SyntheticRateSource(seed=0)))
+    pd.testing.assert_series_equal(second["rf"], expected_rf(second, SyntheticRateSource(seed=1)))
+    assert not np.allclose(first["rf"], second["rf"])
+    pd.testing.assert_frame_equal(first.drop(columns="rf"), second.drop(columns="rf"))
+
+
+def test_load_data_projects_rf_in_requested_order(tmp_path):
+    csv_path = str(tmp_path / "msf.csv")
+    make_synthetic_crsp(n_permnos=20, n_months=36).to_csv(csv_path, index=False)
+    preprocessor = PreProcessor(rate_source=SyntheticRateSource(), cache_dir=str(tmp_path / "cache"))
+    full = preprocessor.load_data(csv_path)
+
+    for columns in (["PERMNO", "rf", "RET"], ["rf", "date"], ["PERMNO", "RET"]):
+        projected = preprocessor.load_data(csv_path, columns=columns)
+        assert list(projected.columns) == columns
+        pd.testing.assert_frame_equal(projected, full[columns])
+
+
+def test_risk_free_key_covers_only_the_attached_rates(tmp_path):
+    csv_path = str(tmp_path / "msf.csv")
+    panel = make_synthetic_crsp(n_permnos=20, n_months=36)
+    panel.to_csv(csv_path, index=False)
+    preprocessor = PreProcessor(rate_source=SyntheticRateSource(), cache_dir=str(tmp_path / "cache"))
+    rf = preprocessor.risk_free_rate()
+    last = pd.to_datetime(panel["date"]).max()
+
+    key = preprocessor.risk_free_key(csv_path, rf[rf["date"] <= last])
+    # Later observations (a daily refresh) are never attached to the panel
+    assert preprocessor.risk_free_key(csv_path, rf) == key
+    revised = rf.copy()
+    revised.loc[revised["date"] <= last, "rf"] += 0.01
+    assert preprocessor.risk_free_key(csv_path, revised) != key
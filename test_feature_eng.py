@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from benchmark import SyntheticRateSource, make_synthetic_crsp
+from data_processor import PreProcessor
+from feature_eng import FeatureEngineer
+from rolling import MOMENT_BYTES
+
+
+def estimate(crsp, memory_budget_mb):
+    feature_eng = FeatureEngineer(crsp.copy(), crsp.copy(), universe="all", memory_budget_mb=memory_budget_mb)
+    feature_eng.excess_returns()
+    betas = feature_eng.compute_universe_betas([12, 36])
+    return feature_eng, feature_eng.calculate_volatilities(betas, [12, 36])
+
+
+def test_memory_budget_shards_rolling_moments(tmp_path):
+    csv_path = str(tmp_path / "msf.csv")
+    make_synthetic_crsp(n_permnos=300, n_months=60).to_csv(csv_path, index=False)
+    crsp = PreProcessor(rate_source=SyntheticRateSource(), cache_dir=str(tmp_path / "cache")).load_data(csv_path)
+
+    whole, expected = estimate(crsp, memory_budget_mb=1024)
+    # A budget below the panel's moments builds them a PERMNO range at a time
+    sharded, result = estimate(crsp, memory_budget_mb=len(crsp) * MOMENT_BYTES / 2**20 / 5)
+
+    assert whole._moments is not None
+    assert sharded._moments is None and sharded.shard_rows < len(crsp) / 4
+    pd.testing.assert_frame_equal(result, expected)
+    assert np.isfinite(result["beta_12m"]).any()
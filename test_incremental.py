@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from feature_eng import FeatureEngineer
+
+LOOKBACKS = [12, 24, 36]
+
+
+def make_panel(n_permnos=40, start="1995-01-01", end="2001-12-31", seed=0):
+    """Monthly panel dated on the last business day, so month-end dates shift from year to year."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, end, freq="BME")
+    mkt = rng.normal(0.01, 0.04, len(dates))
+    rows = []
+    for permno in range(10001, 10001 + n_permnos):
+        # Staggered listings and a few missing returns, as in CRSP
+        first = rng.integers(0, 24)
+        beta = rng.uniform(0.5, 1.5)
+        ret = beta * mkt[first:] + rng.normal(0, 0.08, len(dates) - first)
+        ret[rng.random(len(ret)) < 0.05] = np.nan
+        rows.append(pd.DataFrame({"PERMNO": permno, "date": dates[first:], "RETX": ret, "vwretd": mkt[first:]}))
+    crsp = pd.concat(rows, ignore_index=True)
+    crsp["rf"] = 0.002
+    crsp["year"] = crsp["date"].dt.year
+    return crsp
+
+
+def batch_estimates(crsp):
+    """Year-end betas and trailing volatilities of every row from the batch path."""
+    feature_eng = FeatureEngineer(crsp.copy(), crsp.copy(), universe="all")
+    feature_eng.excess_returns()
+    betas = feature_eng.compute_universe_betas(LOOKBACKS)
+    return feature_eng.calculate_volatilities(betas, LOOKBACKS)
+
+
+def test_update_matches_batch_on_shifting_month_ends():
+    crsp = make_panel()
+    seed = crsp[crsp["date"] <= "2000-06-30"]
+    feature_eng = FeatureEngineer(seed.copy(), seed.copy(), universe="all")
+    feature_eng.excess_returns()
+    state = feature_eng.incremental_state(LOOKBACKS)
+
+    updated = state.update(crsp[crsp["date"] > "2000-06-30"])
+    batch = batch_estimates(crsp)
+    # Emitted betas are year-to-date, so they equal the batch year-end betas in December
+    december = updated[updated["date"].dt.month == 12].merge(batch, on=["PERMNO", "date"], suffixes=("", "_batch"))
+    assert len(december) > 0
+    # 2000-12-29 against 1997-12-31: the 36-month window holds 37 monthly rows
+    assert (december["date"] == "2000-12-29").any()
+
+    for lb in LOOKBACKS:
+        for name in [f"beta_{lb}m", f"TVOL_{lb}m", f"SVOL_{lb}m", f"IVOL_{lb}m"]:
+            np.testing.assert_allclose(december[name], december[f"{name}_batch"], rtol=1e-9, atol=1e-12,
+                                       err_msg=name)
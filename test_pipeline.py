@@ -0,0 +1,43 @@
+import importlib
+from pipeline import ArtifactCache, Pipeline, Stage
+
+
+def double(x):
+    return 2 * x
+
+
+def write_module(path, body):
+    path.write_text(body)
+    importlib.invalidate_caches()
+
+
+def test_stage_key_covers_delegated_module_source(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    write_module(tmp_path / "scaling.py", "FACTOR = 2\n")
+
+    def stages():
+        return [Stage("base", lambda: 21), Stage("scaled", double, deps=["base"], code=["scaling"])]
+
+    before = Pipeline(stages()).keys
+    write_module(tmp_path / "scaling.py", "FACTOR = 3\n")
+    after = Pipeline(stages()).keys
+
+    assert before["base"] == after["base"]
+    assert before["scaled"] != after["scaled"]
+
+
+def test_cached_stage_reruns_after_module_edit(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    write_module(tmp_path / "scaling.py", "FACTOR = 2\n")
+    cache = ArtifactCache(str(tmp_path / "artifacts"))
+
+    def run():
+        pipeline = Pipeline([Stage("base", lambda: 21), Stage("scaled", double, deps=["base"], code=["scaling"])],
+                            cache=cache)
+        pipeline.run()
+        return pipeline.executed
+
+    assert run() == ["base", "scaled"]
+    assert run() == []
+    write_module(tmp_path / "scaling.py", "FACTOR = 3\n")
+    assert run() == ["scaled"]
@@ -1,21 +1,80 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def render_figure(annual_stats, dpi, fmt, method, kwargs):
+    """Worker entry point: draw one figure headlessly and return the file it was saved to."""
+    plt.switch_backend('Agg')
+    # No plot reads the beta panel, so it is not shipped to the workers
+    visualizer = Visualizations(None, annual_stats, dpi=dpi, fmt=fmt, interactive=False)
+    return getattr(visualizer, method)(**kwargs)
 
 
 class Visualizations:
-    def __init__(self, betas_df, annual_stats_df):
-        """Initialize Visualizations class."""
+    def __init__(self, betas_df, annual_stats_df, dpi=300, fmt=None, interactive=True):
+        """Initialize Visualizations class.
+
+        With interactive=False figures are saved and closed instead of shown. fmt
+        (e.g. "pdf", "svg") overrides the extension of every save_path.
+        """
         self.betas = betas_df
         self.annual_stats = annual_stats_df
+        self.dpi = dpi
+        self.fmt = fmt
+        self.interactive = interactive
+        self._industry_lines = None
+
+    @property
+    def industry_lines(self):
+        """annual_stats pivoted once to one column per (statistic, industry), indexed by year."""
+        if self._industry_lines is None:
+            stats = self.annual_stats.assign(_present=True)
+            self._industry_lines = stats.pivot(index='year', columns='industry').sort_index()
+        return self._industry_lines
+
+    def industries(self):
+        """Industries in the order they first appear in annual_stats (the legend order)."""
+        return self.annual_stats['industry'].unique()
+
+    def plot_industry_lines(self, ax, column, **style):
+        """Draw one line per industry for an annual_stats column."""
+        lines, present = self.industry_lines[column], self.industry_lines['_present']
+        for industry in self.industries():
+            # Only the years the industry has rows for, as the unpivoted frame had
+            series = lines[industry][present[industry].notna()]
+            ax.plot(series.index, series.values, label=industry, **style)
+
+    def finish(self, fig, save_path=None):
+        """Save the figure, then show it or (headless) close it to free its memory."""
+        if save_path:
+            if self.fmt:
+                save_path = f"{os.path.splitext(save_path)[0]}.{self.fmt}"
+            fig.savefig(save_path, dpi=self.dpi, format=self.fmt, bbox_inches='tight')
+
+        if self.interactive:
+            plt.show()
+        else:
+            plt.close(fig)
+        return save_path
+
+    def render_batch(self, jobs, n_jobs=None):
+        """Render figures concurrently in a process pool with the Agg backend.
+
+        jobs is a list of (method name, kwargs) pairs, e.g.
+        ("plot_volatility_trends", {"vol_trends_df": df, "save_path": "vol.png"}).
+        Returns the saved paths in job order.
+        """
+        with ProcessPoolExecutor(max_workers=n_jobs or min(len(jobs), os.cpu_count())) as pool:
+            futures = [pool.submit(render_figure, self.annual_stats, self.dpi, self.fmt, method, kwargs)
+                       for method, kwargs in jobs]
+            return [future.result() for future in futures]
 
     def plot_beta_mean_by_industry(self, beta_period='beta_12m', figsize=(14, 8), save_path=None):
         """Plot mean beta trends by industry over time (separate from std)."""
-        plt.figure(figsize=figsize)
-
-        for industry in self.annual_stats['industry'].unique():
-            df = self.annual_stats[self.annual_stats['industry'] == industry]
-            plt.plot(df['year'], df[f'{beta_period}_mean'],
-                    label=industry, marker='o', markersize=4, linewidth=2)
+        fig = plt.figure(figsize=figsize)
+        self.plot_industry_lines(plt.gca(), f'{beta_period}_mean', marker='o', markersize=4, linewidth=2)
 
         plt.title(f'Mean {beta_period} by Industry Over Time', fontsize=14, fontweight='bold')
         plt.xlabel('Year', fontsize=12)
@@ -24,19 +83,12 @@ class Visualizations:
         plt.grid(True, alpha=0.3)
         plt.tight_layout()
 
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-
-        plt.show()
+        return self.finish(fig, save_path)
 
     def plot_beta_std_by_industry(self, beta_period='beta_12m', figsize=(14, 8), save_path=None):
         """Plot standard deviation of beta by industry over time (separate from mean)."""
-        plt.figure(figsize=figsize)
-
-        for industry in self.annual_stats['industry'].unique():
-            df = self.annual_stats[self.annual_stats['industry'] == industry]
-            plt.plot(df['year'], df[f'{beta_period}_std'],
-                    label=industry, marker='s', markersize=4, linewidth=2)
+        fig = plt.figure(figsize=figsize)
+        self.plot_industry_lines(plt.gca(), f'{beta_period}_std', marker='s', markersize=4, linewidth=2)
 
         plt.title(f'Standard Deviation of {beta_period} by Industry Over Time', fontsize=14, fontweight='bold')
         plt.xlabel('Year', fontsize=12)
@@ -45,10 +97,7 @@ class Visualizations:
         plt.grid(True, alpha=0.3)
         plt.tight_layout()
 
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-            
-        plt.show()
+        return self.finish(fig, save_path)
 
     def plot_all_beta_periods_mean(self, figsize=(14, 18), save_path=None):
         """Plot mean beta for all three periods (12m, 24m, 36m) in subplots."""
@@ -57,10 +106,7 @@ class Visualizations:
         titles = ['12-Month Beta', '24-Month Beta', '36-Month Beta']
 
         for ax, beta_period, title in zip(axes, beta_periods, titles):
-            for industry in self.annual_stats['industry'].unique():
-                df = self.annual_stats[self.annual_stats['industry'] == industry]
-                ax.plot(df['year'], df[f'{beta_period}_mean'],
-                        label=industry, marker='o', markersize=3, linewidth=1.5)
+            self.plot_industry_lines(ax, f'{beta_period}_mean', marker='o', markersize=3, linewidth=1.5)
 
             ax.set_title(f'Mean {title} by Industry', fontsize=12, fontweight='bold')
             ax.set_ylabel('Mean Beta', fontsize=11)
@@ -71,10 +117,7 @@ class Visualizations:
         plt.suptitle('Beta Trends by Industry (Mean)', fontsize=14, fontweight='bold', y=0.995)
         plt.tight_layout()
 
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-            
-        plt.show()
+        return self.finish(fig, save_path)
 
     def plot_all_beta_periods_std(self, figsize=(14, 18), save_path=None):
         """Plot standard deviation of beta for all three periods (12m, 24m, 36m) in subplots."""
@@ -83,10 +126,7 @@ class Visualizations:
         titles = ['12-Month Beta', '24-Month Beta', '36-Month Beta']
 
         for ax, beta_period, title in zip(axes, beta_periods, titles):
-            for industry in self.annual_stats['industry'].unique():
-                df = self.annual_stats[self.annual_stats['industry'] == industry]
-                ax.plot(df['year'], df[f'{beta_period}_std'],
-                        label=industry, marker='s', markersize=3, linewidth=1.5)
+            self.plot_industry_lines(ax, f'{beta_period}_std', marker='s', markersize=3, linewidth=1.5)
 
             ax.set_title(f'Std Dev of {title} by Industry', fontsize=12, fontweight='bold')
             ax.set_ylabel('Beta Std Dev', fontsize=11)
@@ -97,10 +137,7 @@ class Visualizations:
         plt.suptitle('Beta Dispersion by Industry (Standard Deviation)', fontsize=14, fontweight='bold', y=0.995)
         plt.tight_layout()
 
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-
-        plt.show()
+        return self.finish(fig, save_path)
 
     def plot_volatility_trends(self, vol_trends_df, figsize=(14, 16), save_path=None):
         """Plot volatility component trends for all three lookback periods."""
@@ -124,17 +161,14 @@ class Visualizations:
         plt.suptitle("Trends in Stock Volatility Components", fontsize=14, fontweight='bold', y=0.995)
         plt.tight_layout()
 
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-
-        plt.show()
+        return self.finish(fig, save_path)
 
     def plot_missing_betas_heatmap(self, missing_df, beta_period='beta_12m', figsize=(14, 10), save_path=None):
         """Plot heatmap of missing beta percentages by year and industry."""
         subset = missing_df[missing_df['beta_period'] == beta_period].copy()
         pivot = subset.pivot(index='industry', columns='year', values='missing_pct')
 
-        plt.figure(figsize=figsize)
+        fig = plt.figure(figsize=figsize)
         im = plt.imshow(pivot.values, cmap='YlOrRd', aspect='auto', interpolation='nearest')
 
         plt.colorbar(im, label='Missing %')
@@ -145,7 +179,4 @@ class Visualizations:
         plt.title(f'Missing {beta_period} by Year and Industry (%)', fontsize=14, fontweight='bold')
         plt.tight_layout()
 
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-
-        plt.show()
+        return self.finish(fig, save_path)
@@ -0,0 +1,173 @@
+import pandas as pd
+import numpy as np
+from rolling import RollingMoments, ols_from_sums, window_starts
+
+ESTIMATORS = ["ols", "dimson", "scholes_williams", "vasicek"]
+# Months per estimation period; windows end on the last calendar day of each period
+FREQUENCIES = {"month": 1, "quarter": 3, "year": 12}
+
+
+def market_leads_lags(index, x_col="excess_mkt"):
+    """Previous- and next-month market returns for every row, from the date-level market series."""
+    x = index.column(x_col).astype(np.float64)
+    dates, first = np.unique(index.days, return_index=True)
+    market = x[first]
+    pos = np.searchsorted(dates, index.days)
+    lag = np.where(pos > 0, market[np.maximum(pos - 1, 0)], np.nan)
+    lead = np.where(pos < len(dates) - 1, market[np.minimum(pos + 1, len(dates) - 1)], np.nan)
+    return lag, lead
+
+
+def pair_moments(prefix, a, b):
+    """Per-row moments of a regressor a and a regressand b over rows where both are present."""
+    valid = ~(np.isnan(a) | np.isnan(b))
+    a = np.where(valid, a, 0.0)
+    b = np.where(valid, b, 0.0)
+    return {f"{prefix}_n": valid, f"{prefix}_a": a, f"{prefix}_b": b,
+            f"{prefix}_aa": a * a, f"{prefix}_ab": a * b, f"{prefix}_bb": b * b}
+
+
+def estimator_moments(index, estimators, x_col="excess_mkt", y_col="excess_stock"):
+    """The per-row statistics the requested estimators need, to be cumulated in one pass."""
+    x = index.column(x_col).astype(np.float64)
+    y = index.column(y_col).astype(np.float64)
+    moments = pair_moments("ols", x, y)
+    if {"dimson", "scholes_williams"} & set(estimators):
+        lag, lead = market_leads_lags(index, x_col)
+    if "scholes_williams" in estimators:
+        moments.update(pair_moments("lag", lag, y))
+        moments.update(pair_moments("lead", lead, y))
+        moments.update(pair_moments("auto", lag, x))
+    if "dimson" in estimators:
+        valid = ~(np.isnan(x) | np.isnan(lag) | np.isnan(y))
+        xd, ld, yd = (np.where(valid, v, 0.0) for v in (x, lag, y))
+        moments.update({"dim_n": valid, "dim_x": xd, "dim_l": ld, "dim_y": yd,
+                        "dim_xx": xd * xd, "dim_ll": ld * ld, "dim_xl": xd * ld,
+                        "dim_xy": xd * yd, "dim_ly": ld * yd})
+    return moments
+
+
+def pair_slope(sums, prefix, min_obs=3):
+    """Univariate OLS slope of b on a from pair sums (NaN when undetermined)."""
+    renamed = {key: sums[f"{prefix}_{name}"] for key, name in
+               [("n", "n"), ("x", "a"), ("y", "b"), ("xx", "aa"), ("xy", "ab")]}
+    return ols_from_sums(renamed, min_obs)[0]
+
+
+def dimson_beta(sums, min_obs=4):
+    """Dimson (1979) beta: sum of the slopes on the contemporaneous and lagged market in one regression."""
+    n = sums["dim_n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sxx = sums["dim_xx"] - sums["dim_x"] ** 2 / n
+        sll = sums["dim_ll"] - sums["dim_l"] ** 2 / n
+        sxl = sums["dim_xl"] - sums["dim_x"] * sums["dim_l"] / n
+        sxy = sums["dim_xy"] - sums["dim_x"] * sums["dim_y"] / n
+        sly = sums["dim_ly"] - sums["dim_l"] * sums["dim_y"] / n
+        det = sxx * sll - sxl * sxl
+        b_x = (sxy * sll - sly * sxl) / det
+        b_l = (sly * sxx - sxy * sxl) / det
+        return np.where((n >= min_obs) & (det > 0), b_x + b_l, np.nan)
+
+
+def scholes_williams_beta(sums, beta):
+    """Scholes-Williams (1977) beta: (lag + contemporaneous + lead slopes) / (1 + 2 market autocorrelation)."""
+    beta_lag = pair_slope(sums, "lag")
+    beta_lead = pair_slope(sums, "lead")
+    n = sums["auto_n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s_ll = n * sums["auto_aa"] - sums["auto_a"] ** 2
+        s_xx = n * sums["auto_bb"] - sums["auto_b"] ** 2
+        rho = (n * sums["auto_ab"] - sums["auto_a"] * sums["auto_b"]) / np.sqrt(s_ll * s_xx)
+        return (beta_lag + beta + beta_lead) / (1 + 2 * rho)
+
+
+def ols_standard_error(sums, beta, min_obs=3):
+    """Squared standard error of the OLS slope from pair sums."""
+    n = sums["ols_n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sxx = sums["ols_aa"] - sums["ols_a"] ** 2 / n
+        syy = sums["ols_bb"] - sums["ols_b"] ** 2 / n
+        resid_var = np.maximum(syy - beta * beta * sxx, 0.0) / (n - 2)
+        return np.where(n >= min_obs, resid_var / sxx, np.nan)
+
+
+def vasicek_shrink(beta, se2, groups):
+    """Vasicek (1973) shrinkage of each beta toward the cross-sectional mean of its group (end date).
+
+    The prior is the cross-sectional mean and variance of the OLS betas; groups with
+    fewer than two betas keep the OLS estimate.
+    """
+    ok = ~(np.isnan(beta) | np.isnan(se2))
+    codes, uniques = pd.factorize(groups)
+    count = np.bincount(codes[ok], minlength=len(uniques)).astype(np.float64)
+    total = np.bincount(codes[ok], weights=beta[ok], minlength=len(uniques))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / count
+        dev = np.where(ok, beta - mean[codes], 0.0)
+        prior_var = np.bincount(codes, weights=dev * dev, minlength=len(uniques)) / (count - 1)
+        weight = prior_var[codes] / (prior_var[codes] + se2)
+    shrunk = weight * beta + (1 - weight) * mean[codes]
+    return np.where(ok & (count[codes] >= 2), shrunk, beta)
+
+
+def period_end_queries(index, frequency):
+    """(PERMNO, period end) queries for every period in which a PERMNO has an observation."""
+    step = FREQUENCIES[frequency]
+    months = index.dates.astype("datetime64[M]").astype(np.int64)
+    start = months - months % step
+    # Rows are (PERMNO, date)-sorted, so a period starts wherever the PERMNO or the period changes
+    new = np.r_[True, (index.codes[1:] != index.codes[:-1]) | (start[1:] != start[:-1])]
+    ends = (start[new] + step).astype("datetime64[M]").astype("datetime64[D]") - 1
+    return index.permnos[index.codes[new]], ends.astype("datetime64[ns]")
+
+
+def what_if_betas(index, lookbacks=[12, 24, 36], estimators=["ols"], frequencies=["year"],
+                  x_col="excess_mkt", y_col="excess_stock", batch_size=None):
+    """Estimate betas for every (lookback, estimator, end-date frequency) configuration in one pass.
+
+    The per-row statistics of all requested estimators are cumulated once per
+    PERMNO; every configuration then reads its window sums from the same arrays,
+    and the window bounds of each (frequency, lookback) are resolved once for all
+    estimators. Returns a long table with one row per PERMNO, end date and configuration.
+    """
+    unknown = set(estimators) - set(ESTIMATORS)
+    if unknown:
+        raise ValueError(f"unknown estimators {sorted(unknown)}; choose from {ESTIMATORS}")
+    moments = RollingMoments(index, moments=estimator_moments(index, estimators, x_col, y_col))
+
+    tables = []
+    for frequency in frequencies:
+        permnos, end_dates = period_end_queries(index, frequency)
+        n = len(permnos)
+        step = batch_size or max(n, 1)
+        for lb in lookbacks:
+            out = {name: np.empty(n) for name in ["n_obs", *estimators]}
+            se2 = np.empty(n) if "vasicek" in estimators else None
+            for lo in range(0, n, step):
+                rows = slice(lo, lo + step)
+                bounds = index.window_bounds(permnos[rows], window_starts(end_dates[rows], lb), end_dates[rows])
+                sums = moments.sums(bounds)
+                beta = pair_slope(sums, "ols")
+                out["n_obs"][rows] = sums["ols_n"]
+                for estimator in estimators:
+                    if estimator in ("ols", "vasicek"):
+                        out[estimator][rows] = beta
+                    elif estimator == "dimson":
+                        out[estimator][rows] = dimson_beta(sums)
+                    elif estimator == "scholes_williams":
+                        out[estimator][rows] = scholes_williams_beta(sums, beta)
+                if se2 is not None:
+                    se2[rows] = ols_standard_error(sums, beta)
+            if se2 is not None:
+                # The prior is cross-sectional, so shrinkage waits until every batch is in
+                out["vasicek"] = vasicek_shrink(out["vasicek"], se2, end_dates)
+
+            for estimator in estimators:
+                tables.append(pd.DataFrame({
+                    "PERMNO": permnos, "date": end_dates, "frequency": frequency, "lookback": lb,
+                    "estimator": estimator, "beta": out[estimator], "n_obs": out["n_obs"].astype(np.int64),
+                }))
+
+    if not tables:
+        return pd.DataFrame(columns=["PERMNO", "date", "frequency", "lookback", "estimator", "beta", "n_obs"])
+    return pd.concat(tables, ignore_index=True)